@@ -0,0 +1,88 @@
+"""
+Compare the vectorized itinerary.score_spots with the original
+iterrows + sklearn cosine_similarity implementation.
+
+    cd backend
+    python -m benchmarks.bench_score_spots
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itinerary as itin  # noqa: E402
+from catalogue import build_vocab  # noqa: E402
+
+CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "locations.csv")
+PREFS = ["History", "Art", "Nature"]
+
+
+def legacy_score_spots(spots_df: pd.DataFrame, user_preferences: list[str]) -> pd.DataFrame:
+    """score_spots as it was before vectorization, kept here as the baseline."""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    if spots_df.empty or not user_preferences:
+        spots_df = spots_df.copy()
+        spots_df["rec_score"] = 1.0
+        return spots_df
+
+    all_categories = spots_df["category"].unique().tolist()
+    user_vec = np.array([[1 if cat in user_preferences else 0 for cat in all_categories]])
+    spot_vecs = np.array([
+        [1 if row["category"] == cat else 0 for cat in all_categories]
+        for _, row in spots_df.iterrows()
+    ])
+
+    if user_vec.sum() == 0 or spot_vecs.sum() == 0:
+        scores = np.ones(len(spots_df))
+    else:
+        scores = cosine_similarity(user_vec, spot_vecs)[0]
+
+    spots_df = spots_df.copy()
+    spots_df["rec_score"] = scores
+    return spots_df.sort_values("rec_score", ascending=False)
+
+
+def synthetic(base: pd.DataFrame, rows: int, seed: int = 0) -> pd.DataFrame:
+    """Resample the real catalogue up to `rows` rows with jittered coordinates."""
+    rng = np.random.default_rng(seed)
+    df = base.sample(n=rows, replace=True, random_state=seed).reset_index(drop=True)
+    df["name"] = df["name"] + " #" + pd.Series(range(rows)).astype(str)
+    df["lat"] = df["lat"] + rng.normal(0, 0.01, rows)
+    df["lon"] = df["lon"] + rng.normal(0, 0.01, rows)
+    return df
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(label: str, df: pd.DataFrame, repeat: int) -> None:
+    vocab = build_vocab(df)
+    old = legacy_score_spots(df, PREFS)
+    new = itin.score_spots(df, PREFS, vocab)
+    assert old.index.equals(new.index), "ordering differs from the legacy scorer"
+    assert np.allclose(old["rec_score"], new["rec_score"])
+
+    t_old = timeit(lambda: legacy_score_spots(df, PREFS), repeat)
+    t_new = timeit(lambda: itin.score_spots(df, PREFS, vocab), repeat)
+    users = [PREFS, ["Food"], ["Culture", "Sightseeing"], []] * 16
+    t_batch = timeit(lambda: itin.score_spots_batch(df, users, vocab), repeat)
+    print(f"{label:>18} rows={len(df):>7}  legacy={t_old * 1e3:9.2f} ms  "
+          f"vectorized={t_new * 1e3:8.2f} ms  ({t_old / t_new:6.1f}x)  "
+          f"batch[{len(users)} users]={t_batch * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    base = pd.read_csv(CSV_PATH)
+    run("locations.csv", base, repeat=20)
+    run("synthetic 100k", synthetic(base, 100_000), repeat=2)
@@ -0,0 +1,416 @@
+"""
+In-memory stand-ins for Supabase and OpenWeather, so the API can be driven
+end to end (FastAPI TestClient) without network access.
+
+Only the parts of supabase-py / PostgREST the backend actually uses are
+implemented: table queries with embeds, the filters in use, inserts, updates,
+deletes with ON DELETE CASCADE, the Postgres functions from DOCUMENTATION.md,
+storage signing and auth lookups.
+"""
+import copy
+import re
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import jwt
+
+# child table -> (fk column, parent table)
+RELATIONS = {
+    "trip_spots": ("trip_id", "trips"),
+    "memories": ("trip_id", "trips"),
+}
+# tables whose deletes leave a tombstone (the triggers in DOCUMENTATION.md)
+TOMBSTONED = {"trips": "trips", "trip_spots": "spots", "memories": "memories"}
+
+JWT_SECRET = "benchmark-secret-benchmark-secret"
+_last = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _now() -> str:
+    # wall clock, but strictly increasing so created_at ordering stays stable
+    global _last
+    _last = max(datetime.now(timezone.utc), _last + timedelta(microseconds=1))
+    return _last.isoformat()
+
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+def _project(row, cols):
+    if row is None:
+        return None
+    if "*" in cols:
+        return dict(row)
+    return {c: row.get(c) for c in cols if c}
+
+
+def _cmp(a, op, b):
+    if op == "eq": return a == b
+    if op == "neq": return a != b
+    if op == "in": return a in b
+    if op == "is": return a is None if b in (None, "null") else a == b
+    if a is None: return False
+    if op == "lt": return a < b
+    if op == "lte": return a <= b
+    if op == "gt": return a > b
+    if op == "gte": return a >= b
+    raise ValueError(op)
+
+
+def _split_top(expr):
+    parts, depth, cur = [], 0, ""
+    for ch in expr:
+        if ch == "," and depth == 0:
+            parts.append(cur)
+            cur = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _or_term(row, term):
+    """One term of a PostgREST or=(...) filter, e.g. and(a.eq.1,b.lt.2)."""
+    term = term.strip()
+    if term.startswith("and("):
+        return all(_or_term(row, t) for t in _split_top(term[4:-1]))
+    if term.startswith("or("):
+        return any(_or_term(row, t) for t in _split_top(term[3:-1]))
+    col, op, val = term.split(".", 2)
+    val = val.strip('"')
+    cur = row.get(col)
+    if isinstance(cur, (int, float)) and not isinstance(cur, bool):
+        val = type(cur)(val)
+    return _cmp(cur, op, val)
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.op = "select"
+        self.cols = "*"
+        self.filters = []
+        self.orders = []
+        self._limit = None
+        self._range = None
+        self.payload = None
+
+    # ── builders ──
+    def select(self, cols="*", count=None):
+        self.cols = cols
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.op, self.payload = "upsert", rows
+        return self
+
+    def update(self, values):
+        self.op, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def _f(self, col, op, val):
+        self.filters.append((col, op, val))
+        return self
+
+    def eq(self, c, v): return self._f(c, "eq", v)
+    def neq(self, c, v): return self._f(c, "neq", v)
+    def lt(self, c, v): return self._f(c, "lt", v)
+    def lte(self, c, v): return self._f(c, "lte", v)
+    def gt(self, c, v): return self._f(c, "gt", v)
+    def gte(self, c, v): return self._f(c, "gte", v)
+    def in_(self, c, v): return self._f(c, "in", list(v))
+    def is_(self, c, v): return self._f(c, "is", v)
+    def or_(self, expr): return self._f(None, "or", expr)
+
+    def order(self, col, desc=False):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def single(self):
+        return self
+
+    # ── evaluation ──
+    def _embeds(self):
+        """Split `*, child(*)` / `parent!inner(a, b)` into plain columns and embeds."""
+        embeds = [(m.group(1), bool(m.group(2)), [c.strip() for c in m.group(3).split(",")])
+                  for m in re.finditer(r"(\w+)(!inner)?\(([^)]*)\)", self.cols or "")]
+        plain = re.sub(r"\w+(!inner)?\([^)]*\)", "", self.cols or "*")
+        cols = [c.strip() for c in plain.split(",") if c.strip()]
+        return cols or ["*"], embeds
+
+    def _with_embeds(self, row, embeds):
+        out = dict(row)
+        for name, _inner, cols in embeds:
+            if name in RELATIONS and RELATIONS[name][1] == self.table:          # child embed
+                fk = RELATIONS[name][0]
+                out[name] = [_project(k, cols) for k in self.db.tables.get(name, []) if k.get(fk) == row.get("id")]
+            elif self.table in RELATIONS and RELATIONS[self.table][1] == name:  # parent embed
+                fk = RELATIONS[self.table][0]
+                parent = next((p for p in self.db.tables.get(name, []) if p.get("id") == row.get(fk)), None)
+                out[name] = _project(parent, cols)
+        return out
+
+    def _match(self, row, col, op, val):
+        if op == "or":
+            return any(_or_term(row, t) for t in _split_top(val))
+        if "." in col:
+            rel, c = col.split(".", 1)
+            sub = row.get(rel)
+            if isinstance(sub, list):
+                return any(_cmp(s.get(c), op, val) for s in sub)
+            return sub is not None and _cmp(sub.get(c), op, val)
+        return _cmp(row.get(col), op, val)
+
+    def execute(self):
+        self.db.calls += 1
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.op in ("insert", "upsert"):
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            out = []
+            for r in payload:
+                r = dict(r)
+                existing = next((x for x in rows if x["id"] == r["id"]), None) if "id" in r else None
+                if self.op == "upsert" and existing:
+                    existing.update(r)
+                    out.append(copy.deepcopy(existing))
+                    continue
+                r.setdefault("id", str(uuid.uuid4()))
+                r.setdefault("created_at", _now())
+                if self.table in TOMBSTONED:
+                    r["updated_at"] = _now()
+                rows.append(r)
+                out.append(copy.deepcopy(r))
+            return Result(out)
+
+        cols, embeds = self._embeds()
+        matched = []
+        for r in rows:
+            full = self._with_embeds(r, embeds) if embeds else r
+            if all(self._match(full, c, o, v) for c, o, v in self.filters) and \
+                    all(full.get(name) for name, inner, _ in embeds if inner):
+                matched.append((r, full))
+
+        if self.op == "update":
+            for r, _ in matched:
+                r.update(self.payload)
+                if self.table in TOMBSTONED:
+                    r["updated_at"] = _now()
+            return Result([copy.deepcopy(r) for r, _ in matched])
+        if self.op == "delete":
+            gone = {id(r) for r, _ in matched}
+            out = [copy.deepcopy(r) for r, _ in matched]
+            self.db.tables[self.table] = [r for r in rows if id(r) not in gone]
+            self.db.tombstone(self.table, out)
+            self.db.cascade(self.table, out)
+            return Result(out)
+
+        data = [full for _, full in matched]
+        for col, desc in reversed(self.orders):
+            data.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+        if self._range:
+            data = data[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            data = data[:self._limit]
+        keep = cols + [e[0] for e in embeds]
+        return Result([copy.deepcopy(_project(r, keep)) for r in data])
+
+
+class _Bucket:
+    def __init__(self, db, bucket):
+        self.db, self.bucket = db, bucket
+
+    def remove(self, paths):
+        self.db.calls += 1
+        return [{"name": p} for p in paths]
+
+    def create_signed_urls(self, paths, expires_in, options=None):
+        self.db.calls += 1
+        return [{"path": p, "signedURL": f"https://storage.local/{self.bucket}/{p}?e={expires_in}",
+                 "error": None} for p in paths]
+
+
+class _Storage:
+    def __init__(self, db):
+        self.db = db
+
+    def from_(self, bucket):
+        return _Bucket(self.db, bucket)
+
+
+class _Auth:
+    class _User:
+        def __init__(self, uid):
+            self.id = uid
+
+    class _Result:
+        def __init__(self, user):
+            self.user = user
+
+    class _Admin:
+        def delete_user(self, uid):
+            pass
+
+    def __init__(self):
+        self.admin = self._Admin()
+
+    def get_user(self, token):
+        try:
+            uid = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], audience="authenticated")["sub"]
+        except jwt.InvalidTokenError:
+            return self._Result(None)
+        return self._Result(self._User(uid))
+
+
+class _Rpc:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params or {}
+
+    def execute(self):
+        self.db.calls += 1
+        fn = self.db.rpcs.get(self.name)
+        if fn is None:
+            raise RuntimeError(f"Could not find the function public.{self.name} (PGRST202)")
+        return Result(fn(self.db, **self.params))
+
+
+class FakeSupabase:
+    def __init__(self, locations: list[dict] | None = None):
+        self.tables: dict[str, list] = {"locations": list(locations or [])}
+        self.calls = 0
+        self.storage = _Storage(self)
+        self.auth = _Auth()
+        self.rpcs = dict(RPCS)
+
+    def table(self, name):
+        return Query(self, name)
+
+    def rpc(self, name, params=None):
+        return _Rpc(self, name, params)
+
+    def tombstone(self, table, deleted):
+        if table not in TOMBSTONED:
+            return
+        owners = {t["id"]: t.get("user_id") for t in self.tables.get("trips", [])}
+        for r in deleted:
+            # child rows only while their trip still exists, like the trigger
+            user_id = r.get("user_id") if table == "trips" else owners.get(r.get("trip_id"))
+            if user_id:
+                self.tables.setdefault("tombstones", []).append({
+                    "user_id": user_id, "entity": TOMBSTONED[table],
+                    "entity_id": r["id"], "deleted_at": _now()})
+
+    def cascade(self, table, deleted):
+        ids = {r["id"] for r in deleted}
+        for child, (fk, parent) in RELATIONS.items():
+            if parent == table and ids:
+                self.tables[child] = [r for r in self.tables.get(child, []) if r.get(fk) not in ids]
+
+
+# ── Postgres functions (see DOCUMENTATION.md) ─────────────────────────────────
+def _save_trips(db, p_trips):
+    out = []
+    for item in p_trips:
+        t = db.table("trips").insert(item["trip"]).execute().data[0]
+        rows = [{**s, "trip_id": t["id"]} for s in item["spots"]]
+        t["spots"] = db.table("trip_spots").insert(rows).execute().data if rows else []
+        out.append(t)
+    return out
+
+
+def _replace_trip_day(db, p_trip_id, p_day_num, p_spots, p_cost):
+    db.table("trip_spots").delete().eq("trip_id", p_trip_id).eq("day_num", p_day_num).execute()
+    db.table("trips").update({"cost": p_cost}).eq("id", p_trip_id).execute()
+    rows = [{**s, "trip_id": p_trip_id} for s in p_spots]
+    return db.table("trip_spots").insert(rows).execute().data if rows else []
+
+
+def _swap_trip_spot(db, p_trip_id, p_spot_id, p_spot, p_cost):
+    if p_cost is not None:
+        db.table("trips").update({"cost": p_cost}).eq("id", p_trip_id).execute()
+    return db.table("trip_spots").update(p_spot).eq("id", p_spot_id).eq("trip_id", p_trip_id).execute().data
+
+
+def _sync_changes(db, p_user_id, p_since):
+    now = _now()
+    queries = [
+        db.table("trips").select("*").eq("user_id", p_user_id),
+        db.table("trip_spots").select("*, trips!inner(user_id)").eq("trips.user_id", p_user_id),
+        db.table("memories").select("*, trips!inner(user_id)").eq("trips.user_id", p_user_id),
+    ]
+    if p_since:
+        queries = [q.gt("updated_at", p_since) for q in queries]
+    trips, spots, memories = (q.execute().data for q in queries)
+    for r in spots + memories:
+        r.pop("trips", None)
+    deleted = (db.table("tombstones").select("entity, entity_id").eq("user_id", p_user_id)
+               .gt("deleted_at", p_since).execute().data) if p_since else []
+    return {"now": now, "trips": trips, "spots": spots, "memories": memories, "deleted": deleted}
+
+
+RPCS = {
+    "save_trips": _save_trips,
+    "replace_trip_day": _replace_trip_day,
+    "swap_trip_spot": _swap_trip_spot,
+    "sync_changes": _sync_changes,
+}
+
+
+# ── Auth ──────────────────────────────────────────────────────────────────────
+def token(user_id: str, ttl: int = 3600) -> str:
+    """A Supabase-style access token the backend verifies locally."""
+    return jwt.encode({"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + ttl},
+                      JWT_SECRET, algorithm="HS256")
+
+
+# ── OpenWeather ───────────────────────────────────────────────────────────────
+def forecast(rainy_days: tuple[int, ...] = (1,), temp: float = 18.0) -> dict:
+    """A 5-day / 3-hour forecast payload starting today."""
+    today = date.today()
+    return {"cod": "200", "list": [
+        {"dt_txt": f"{(today + timedelta(days=d)).isoformat()} {h:02d}:00:00",
+         "weather": [{"main": "Rain" if d in rainy_days else "Clear"}],
+         "main": {"temp": temp}}
+        for d in range(5) for h in range(0, 24, 3)
+    ]}
+
+
+def install(locations: list[dict]) -> FakeSupabase:
+    """Point the backend at a fresh fake Supabase and a canned forecast."""
+    import os
+    import db
+    import itinerary as itin
+
+    os.environ["SUPABASE_JWT_SECRET"] = JWT_SECRET
+    fake = FakeSupabase(locations)
+    db._client = fake
+    db._locations_cache = None
+    payload = forecast()
+
+    async def _call(endpoint: str, city: str) -> dict:
+        return payload
+
+    itin._call = _call
+    itin._weather_cache.clear()
+    return fake
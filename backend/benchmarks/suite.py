@@ -0,0 +1,327 @@
+"""
+Benchmark suite for the itinerary engine and the API hot paths.
+
+    cd backend
+    python -m benchmarks.suite                       # full run, JSON on stdout
+    python -m benchmarks.suite --quick -o before.json
+    python -m benchmarks.suite --only organize,budget
+    python -m benchmarks.suite --compare before.json after.json
+
+Engine benchmarks run on locations.csv and on synthetic catalogues scaled up
+to 1000x. Endpoint benchmarks go through FastAPI's TestClient against the
+in-memory Supabase / OpenWeather stand-ins in benchmarks/fakes.py. Each result
+is {"bench", "params", "runs", "median_ms", "min_ms"}; --compare matches
+results by bench + params and exits non-zero on regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime, timezone
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import engine  # noqa: E402
+import itinerary as itin  # noqa: E402
+from benchmarks import fakes  # noqa: E402
+from benchmarks.bench_score_spots import CSV_PATH, synthetic  # noqa: E402
+
+CITY = "Paris"
+SCALES = (1, 10, 100, 1000)
+DAYS = (1, 3, 7, 14, 30)
+PREF_SETS = {
+    "none": [],
+    "culture": ["History", "Art", "Culture"],
+    "food-nature": ["Food", "Nature"],
+}
+TRIP_COUNTS = (10, 100, 1000)
+
+
+# ── Harness ───────────────────────────────────────────────────────────────────
+
+class Suite:
+    def __init__(self, quick: bool):
+        self.quick = quick
+        self.min_time = 0.2 if quick else 1.0   # seconds spent per measurement
+        self.max_runs = 50 if quick else 500
+        self.results: list[dict] = []
+
+    def measure(self, bench: str, fn, **params):
+        fn()  # warm-up, also surfaces errors before timing
+        times, spent = [], 0.0
+        while len(times) < 3 or (spent < self.min_time and len(times) < self.max_runs):
+            t0 = time.perf_counter()
+            fn()
+            dt = time.perf_counter() - t0
+            times.append(dt)
+            spent += dt
+        self.results.append({
+            "bench": bench, "params": params, "runs": len(times),
+            "median_ms": round(statistics.median(times) * 1e3, 4),
+            "min_ms": round(min(times) * 1e3, 4),
+        })
+        print(f"{bench:<24} {json.dumps(params):<60} {statistics.median(times) * 1e3:10.3f} ms",
+              file=sys.stderr)
+
+
+def scaled(base: pd.DataFrame, scale: int) -> pd.DataFrame:
+    return base if scale == 1 else synthetic(base, len(base) * scale, seed=scale)
+
+
+# ── Engine ────────────────────────────────────────────────────────────────────
+
+def bench_organize(s: Suite, base: pd.DataFrame):
+    city_rows = base[base["city"] == CITY]
+    for scale in (SCALES[:2] if s.quick else SCALES):
+        db.set_locations(scaled(city_rows, scale))
+        for days in (DAYS[::2] if s.quick else DAYS):
+            for pref_name, prefs in PREF_SETS.items():
+                seed = iter(range(10 ** 9))
+                s.measure("organize_itinerary", lambda: engine.plan(engine.PlanParams(
+                    city=CITY, days=days, rest_mode=True, user_preferences=tuple(prefs),
+                    rainy_days=frozenset({2}), seed=next(seed))),
+                    scale=scale, rows=len(db.get_city_index(CITY).records), days=days, prefs=pref_name)
+
+
+def bench_score_spots(s: Suite, base: pd.DataFrame):
+    for scale in (SCALES[:2] if s.quick else SCALES):
+        df = scaled(base, scale)
+        vocab = db.build_vocab(df)
+        for pref_name, prefs in PREF_SETS.items():
+            s.measure("score_spots", lambda: itin.score_spots(df, prefs, vocab),
+                      scale=scale, rows=len(df), prefs=pref_name)
+
+
+def bench_budget(s: Suite, base: pd.DataFrame):
+    db.set_locations(base[base["city"] == CITY])
+    for days in DAYS:
+        spots = engine.plan(engine.PlanParams(city=CITY, days=days, rest_mode=True, seed=days))
+        s.measure("predict_total_budget", lambda: itin.predict_total_budget(days, spots), days=days)
+
+
+# ── db.get_trips grouping / sorting ───────────────────────────────────────────
+# A client that hands back canned rows instantly, so only the Python-side
+# grouping, slot sorting and shaping are timed.
+
+class _Canned:
+    def __init__(self, tables: dict[str, list[dict]]):
+        self.tables = tables
+
+    def table(self, name):
+        return _CannedQuery(self.tables.get(name, []))
+
+
+class _CannedQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getattr__(self, _name):
+        return lambda *a, **kw: self
+
+    def execute(self):
+        return fakes.Result(self.rows)
+
+
+def bench_get_trips(s: Suite, base: pd.DataFrame):
+    db.set_locations(base[base["city"] == CITY])
+    client = db._client
+    try:
+        for n in (TRIP_COUNTS[:2] if s.quick else TRIP_COUNTS):
+            trips, spots = [], []
+            for i in range(n):
+                days = 1 + i % 14
+                tid = f"trip-{i}"
+                trips.append({"id": tid, "title": f"Trip {i}", "city": CITY, "days": days, "cost": 100.0,
+                              "status": "Upcoming", "weather_condition": "Clear", "weather_temp": 20,
+                              "created_at": f"2026-01-01T00:00:{i:06d}"})
+                plan = engine.plan(engine.PlanParams(city=CITY, days=days, rest_mode=False, seed=i))
+                spots.extend(db.spot_row(tid, sp, CITY) for sp in reversed(plan))  # unsorted on purpose
+            db._client = _Canned({"trips": trips, "trip_spots": spots})
+            s.measure("db.get_trips", lambda: db.get_trips("bench-user"), trips=n, spots=len(spots))
+            s.measure("db.get_trips", lambda: db.get_trips("bench-user", fields=db.SUMMARY_FIELDS),
+                      trips=n, spots=len(spots), mode="summary")
+    finally:
+        db._client = client
+
+
+# ── Endpoints ─────────────────────────────────────────────────────────────────
+
+def _client(locations: list[dict]):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from fastapi.testclient import TestClient
+    import main
+    fakes.install(locations)
+    return TestClient(main.app)
+
+
+def bench_locations(s: Suite, base: pd.DataFrame):
+    from routers import locations
+
+    for scale in ((1,) if s.quick else SCALES):
+        df = scaled(base, scale)
+        with _client(df.to_dict("records")) as c:
+            h = {"Authorization": f"Bearer {fakes.token('bench-user')}"}
+
+            def cold():
+                locations._views.clear()
+                locations._projections.clear()
+                c.get("/locations", headers={**h, "Accept-Encoding": "identity"})
+
+            s.measure("GET /locations", cold, scale=scale, rows=len(df), cache="cold")
+            for enc in ("identity", "gzip"):
+                s.measure("GET /locations", lambda: c.get("/locations", headers={**h, "Accept-Encoding": enc}),
+                          scale=scale, rows=len(df), cache="warm", encoding=enc)
+            s.measure("GET /locations", lambda: c.get(f"/locations?city={CITY}", headers=h),
+                      scale=scale, rows=len(df), cache="warm", view="city")
+            etag = c.get("/locations", headers=h).headers["etag"]
+            s.measure("GET /locations", lambda: c.get("/locations", headers={**h, "If-None-Match": etag}),
+                      scale=scale, rows=len(df), cache="etag-304")
+
+
+def bench_endpoints(s: Suite, base: pd.DataFrame):
+    import ratelimit
+
+    with _client(base.to_dict("records")) as c:
+        h = {"Authorization": f"Bearer {fakes.token('bench-user')}"}
+
+        def generate(days, prefs):
+            ratelimit.backend.clear()
+            r = c.post("/trips/generate", headers=h,
+                       json={"title": "Bench", "city": CITY, "days": days, "user_preferences": prefs})
+            assert r.status_code == 200, r.text
+            return r.json()
+
+        for days in ((3,) if s.quick else (1, 7, 30)):
+            for pref_name, prefs in PREF_SETS.items():
+                s.measure("POST /trips/generate", lambda: generate(days, prefs), days=days, prefs=pref_name)
+
+        trip = generate(7, [])
+        n_trips = len(c.get("/trips", headers=h).json())
+        s.measure("GET /trips", lambda: c.get("/trips", headers=h), trips=n_trips)
+        s.measure("GET /trips", lambda: c.get("/trips?summary=true&limit=20", headers=h),
+                  trips=n_trips, mode="summary", limit=20)
+        s.measure("GET /trips/{id}", lambda: c.get(f"/trips/{trip['id']}", headers=h), days=7)
+        s.measure("GET /share/{id}", lambda: c.get(f"/share/{trip['id']}"), days=7, cache="snapshot")
+
+        def regenerate():
+            ratelimit.backend.clear()
+            assert c.post(f"/trips/{trip['id']}/regenerate-day", headers=h,
+                          json={"day_num": 2}).status_code == 200
+
+        s.measure("POST regenerate-day", regenerate, days=7)
+
+        spot = next(sp for sp in trip["spots"] if sp["day_num"] == 1 and sp["category"] != "Hotel")
+        swap = {"new_name": "Bench Cafe", "new_category": "Food", "new_type": "Indoor",
+                "new_lat": spot["lat"], "new_lon": spot["lon"], "new_cost": 12.0}
+
+        def swap_spot():
+            ratelimit.backend.clear()
+            assert c.patch(f"/trips/{trip['id']}/spots/{spot['id']}", headers=h, json=swap).status_code == 200
+
+        s.measure("PATCH swap spot", swap_spot, days=7)
+
+        for day in range(1, 8):
+            for k in range(3):
+                c.post("/memories", headers=h, json={"trip_id": trip["id"], "day_num": day, "note": "Bench",
+                                                     "image_path": f"bench/{day}-{k}.jpg"})
+        s.measure("GET /memories/{id}/days", lambda: c.get(f"/memories/{trip['id']}/days", headers=h),
+                  memories=21, cache="signed-urls")
+
+        s.measure("GET /sync", lambda: c.get("/sync", headers=h), trips=n_trips, mode="full")
+        since = c.get("/sync", headers=h).json()["watermark"]
+        s.measure("GET /sync", lambda: c.get("/sync", headers=h, params={"since": since}),
+                  trips=n_trips, mode="delta")
+
+
+BENCHES = {
+    "organize": bench_organize,
+    "score": bench_score_spots,
+    "budget": bench_budget,
+    "get_trips": bench_get_trips,
+    "locations": bench_locations,
+    "endpoints": bench_endpoints,
+}
+
+
+# ── Reporting ─────────────────────────────────────────────────────────────────
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Print new/old median ratios; returns the number of regressions."""
+    def load(path):
+        with open(path) as f:
+            report = json.load(f)
+        return report, {(r["bench"], json.dumps(r["params"], sort_keys=True)): r for r in report["results"]}
+
+    old_report, old = load(old_path)
+    new_report, new = load(new_path)
+    print(f"{old_report['meta'].get('commit')} -> {new_report['meta'].get('commit')}")
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]["median_ms"] / max(old[key]["median_ms"], 1e-9)
+        flag = ""
+        if ratio > threshold:
+            flag, regressions = "  REGRESSION", regressions + 1
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"{key[0]:<24} {key[1]:<60} {old[key]['median_ms']:10.3f} -> "
+              f"{new[key]['median_ms']:10.3f} ms  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--quick", action="store_true", help="smaller scales and shorter timings")
+    ap.add_argument("--only", help=f"comma-separated subset of: {', '.join(BENCHES)}")
+    ap.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports")
+    ap.add_argument("--threshold", type=float, default=1.15, help="slowdown ratio that counts as a regression")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+
+    names = args.only.split(",") if args.only else list(BENCHES)
+    unknown = set(names) - set(BENCHES)
+    if unknown:
+        ap.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    base = pd.read_csv(CSV_PATH)
+    suite = Suite(args.quick)
+    for name in names:
+        BENCHES[name](suite, base)
+
+    report = {
+        "meta": {
+            "commit": _commit(), "quick": args.quick, "python": platform.python_version(),
+            "platform": platform.platform(), "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "results": suite.results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
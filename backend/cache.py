@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ── In-process caches ─────────────────────────────────────────────────────────
+# Bounded, thread-safe LRU maps shared by the data layer, auth and the engine.
+# Entries optionally expire `ttl` seconds after they were stored; a per-entry
+# ttl overrides the cache default (e.g. a token's own expiry).
+
+
+class TTLCache:
+    """Thread-safe LRU map with optional per-entry expiry."""
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key → (value, monotonic expiry)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def discard_where(self, pred) -> None:
+        """Drop every entry whose (key, value) satisfies `pred`."""
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if pred(k, v)]:
+                del self._data[key]
+
+    def items(self) -> list[tuple]:
+        """Snapshot of live (key, value) pairs, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, expires) in self._data.items() if expires > now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
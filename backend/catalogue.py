@@ -0,0 +1,239 @@
+import math
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+
+# ── Spatial grid ──────────────────────────────────────────────────────────────
+# Uniform grid over (lat, lon * cos(lat)) so "k nearest" and "within radius"
+# only look at the cells around the query point instead of the whole city.
+# Distances use the same flat-earth metric as itinerary._geo_dist.
+
+class SpatialGrid:
+    def __init__(self, lats, lons):
+        self.lat = np.asarray(lats, dtype=float)
+        self.lon = np.asarray(lons, dtype=float)
+        n = len(self.lat)
+        ok = ~(np.isnan(self.lat) | np.isnan(self.lon))
+        self.kx = math.cos(math.radians(float(self.lat[ok].mean()))) if ok.any() else 1.0
+
+        x, y = self.lon * self.kx, self.lat
+        if ok.any():
+            area = max(np.ptp(x[ok]) * np.ptp(y[ok]), 1e-6)
+            self.cell = max(math.sqrt(area / max(ok.sum(), 1) * 4), 1e-3)  # ~4 points per cell
+        else:
+            self.cell = 1.0
+
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        for i in np.flatnonzero(ok).tolist():
+            key = (math.floor(x[i] / self.cell), math.floor(y[i] / self.cell))
+            self.cells.setdefault(key, []).append(i)
+        keys = list(self.cells) or [(0, 0)]
+        self.min_cx = min(k[0] for k in keys); self.max_cx = max(k[0] for k in keys)
+        self.min_cy = min(k[1] for k in keys); self.max_cy = max(k[1] for k in keys)
+        self.size = n
+
+    def _ring(self, cx: int, cy: int, r: int):
+        if r == 0:
+            yield from self.cells.get((cx, cy), ())
+            return
+        for dx in range(-r, r + 1):
+            yield from self.cells.get((cx + dx, cy - r), ())
+            yield from self.cells.get((cx + dx, cy + r), ())
+        for dy in range(-r + 1, r):
+            yield from self.cells.get((cx - r, cy + dy), ())
+            yield from self.cells.get((cx + r, cy + dy), ())
+
+    def _scan(self, lat: float, lon: float, accept: Callable[[int], bool] | None):
+        """Yield (ring, reach, ids, dists) ring by ring, nearest cells first.
+        Every point closer than `reach` has been yielded once a ring is done."""
+        cx = math.floor(lon * self.kx / self.cell)
+        cy = math.floor(lat / self.cell)
+        kq = math.cos(math.radians(lat))
+        shrink = min(1.0, kq / self.kx) if self.kx else 1.0
+        max_r = max(cx - self.min_cx, self.max_cx - cx, cy - self.min_cy, self.max_cy - cy, 0)
+        for r in range(max_r + 1):
+            ids = [i for i in self._ring(cx, cy, r) if accept is None or accept(i)]
+            if ids:
+                arr = np.asarray(ids)
+                d = np.sqrt((self.lat[arr] - lat) ** 2 + ((self.lon[arr] - lon) * kq) ** 2)
+            else:
+                arr, d = np.empty(0, dtype=int), np.empty(0)
+            yield r, r * self.cell * shrink, arr, d
+
+    def nearest(self, lat: float, lon: float, k: int,
+                accept: Callable[[int], bool] | None = None) -> list[int]:
+        """Ids of the k nearest accepted points, closest first."""
+        found_ids, found_d = [], []
+        for _, reach, ids, d in self._scan(lat, lon, accept):
+            found_ids.extend(ids.tolist()); found_d.extend(d.tolist())
+            if sum(1 for x in found_d if x <= reach) >= k:
+                break
+        order = np.argsort(found_d, kind="stable")[:k]
+        return [found_ids[i] for i in order]
+
+    def within(self, lat: float, lon: float, radius: float,
+               accept: Callable[[int], bool] | None = None) -> list[int]:
+        """Ids of accepted points strictly closer than `radius`."""
+        out = []
+        for _, reach, ids, d in self._scan(lat, lon, accept):
+            out.extend(ids[d < radius].tolist())
+            if reach >= radius:
+                break
+        return out
+
+
+# ── Category vocabulary ───────────────────────────────────────────────────────
+# Fixed category -> integer id mapping so scoring works on small int arrays
+# instead of comparing strings row by row.
+
+class CategoryVocab:
+    def __init__(self, categories):
+        self.categories: list[str] = list(dict.fromkeys(categories))
+        self.ids = {c: i for i, c in enumerate(self.categories)}
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def encode(self, values) -> np.ndarray:
+        """Category ids for `values`; categories outside the vocabulary get len(vocab)."""
+        codes = pd.Categorical(values, categories=self.categories).codes.astype(np.intp)
+        codes[codes < 0] = len(self.categories)
+        return codes
+
+    def preference_matrix(self, preferences: list[list[str]]) -> np.ndarray:
+        """One 0/1 row per user over the vocabulary (plus a trailing 'unknown' column)."""
+        mat = np.zeros((len(preferences), len(self.categories) + 1))
+        for u, prefs in enumerate(preferences):
+            cols = [self.ids[c] for c in set(prefs or []) if c in self.ids]
+            mat[u, cols] = 1.0
+        return mat
+
+
+# ── Location records ──────────────────────────────────────────────────────────
+# The itinerary engine works on integer ids (positions in CityIndex.locs) and
+# these slim records; full row dicts are only built for the final itinerary.
+
+class Location:
+    __slots__ = ("id", "nid", "name", "category", "type", "lat", "lon", "cost", "zone")
+
+    def __init__(self, id: int, nid: int, name: str, category: str, type: str,
+                 lat: float, lon: float, cost: float, zone=None):
+        self.id       = id    # position in the city's records (-1 = not in the catalogue)
+        self.nid      = nid   # id of the first record with this name — identity for "used" checks
+        self.name     = name
+        self.category = category
+        self.type     = type
+        self.lat      = lat
+        self.lon      = lon
+        self.cost     = cost
+        self.zone     = zone
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "lat": self.lat, "lon": self.lon,
+                "category": self.category, "cost": self.cost}
+
+
+# ── Per-city location index ───────────────────────────────────────────────────
+# Built once when the locations table is loaded so request handlers only ever
+# touch the rows of a single city instead of re-scanning the whole catalogue.
+
+@dataclass
+class CityIndex:
+    city: str
+    df: pd.DataFrame                                   # this city's rows only
+    records: list[dict] = field(default_factory=list)  # df.to_dict("records")
+    by_name: dict[str, dict] = field(default_factory=dict)
+    center: tuple[float, float] = (math.nan, math.nan)
+    has_zones: bool = False
+    grid: SpatialGrid | None = None                    # over `records`, by position
+    codes: np.ndarray | None = None                    # category ids, aligned with `records`
+    vocab: CategoryVocab | None = None
+    locs: list[Location] = field(default_factory=list)  # aligned with `records`
+    ids_by_name: dict[str, int] = field(default_factory=dict)
+    hotel_ids: list[int] = field(default_factory=list)
+    food_ids: list[int] = field(default_factory=list)
+    sight_ids: list[int] = field(default_factory=list)
+    # Per-record arrays for the engine's masked selection, aligned with `records`
+    nids: np.ndarray | None = None                     # Location.nid
+    aliases: dict[int, list[int]] = field(default_factory=dict)  # nid → ids, only for repeated names
+    is_hotel: np.ndarray | None = None
+    is_food: np.ndarray | None = None
+    is_sight: np.ndarray | None = None
+    evening_ok: np.ndarray | None = None               # not Nature / History / Art
+    indoor: np.ndarray | None = None
+    zones: np.ndarray | None = None                    # object array, None without zones
+
+    @classmethod
+    def build(cls, city: str, df: pd.DataFrame, vocab: CategoryVocab | None = None) -> "CityIndex":
+        df = df.reset_index(drop=True)
+        idx = cls(city=city, df=df, records=df.to_dict("records"))
+        for rec in idx.records:
+            idx.by_name.setdefault(rec["name"], rec)  # first row wins, like .iloc[0]
+        if idx.records:
+            idx.center = (float(df["lat"].mean()), float(df["lon"].mean()))
+        idx.has_zones = "zone" in df.columns
+        idx.grid = SpatialGrid(df["lat"].to_numpy(), df["lon"].to_numpy())
+        vocab = vocab or build_vocab(df)
+        idx.vocab = vocab
+        idx.codes = vocab.encode(df["category"]) if "category" in df.columns else np.empty(0, dtype=np.intp)
+        idx._build_locs()
+        return idx
+
+    def _build_locs(self):
+        for i, rec in enumerate(self.records):
+            nid = self.ids_by_name.setdefault(rec["name"], i)
+            cat = rec.get("category")
+            self.locs.append(Location(i, nid, rec["name"], cat, rec.get("type"),
+                                      float(rec["lat"]), float(rec["lon"]), rec.get("cost", 0), rec.get("zone")))
+            if cat == "Hotel":
+                self.hotel_ids.append(i)
+            elif cat == "Food":
+                self.food_ids.append(i)
+            else:
+                self.sight_ids.append(i)
+
+        n = len(self.locs)
+        self.nids = np.fromiter((l.nid for l in self.locs), dtype=np.intp, count=n)
+        for l in self.locs:
+            if l.nid != l.id:
+                self.aliases.setdefault(l.nid, [l.nid]).append(l.id)
+        self.is_hotel = np.zeros(n, dtype=bool); self.is_hotel[self.hotel_ids] = True
+        self.is_food  = np.zeros(n, dtype=bool); self.is_food[self.food_ids] = True
+        self.is_sight = np.zeros(n, dtype=bool); self.is_sight[self.sight_ids] = True
+        self.evening_ok = np.fromiter((l.category not in ("Nature", "History", "Art") for l in self.locs),
+                                      dtype=bool, count=n)
+        self.indoor = np.fromiter((l.type == "Indoor" for l in self.locs), dtype=bool, count=n)
+        self.zones = np.empty(n, dtype=object)
+        self.zones[:] = [l.zone for l in self.locs]
+
+    def ids_of(self, nid: int) -> list[int]:
+        """Every record id sharing name id `nid`."""
+        return self.aliases.get(nid) or [nid]
+
+    def spot(self, loc: Location, **extra) -> dict:
+        """Materialize a Location as a full row dict for the API."""
+        base = self.records[loc.id] if loc.id >= 0 else loc.to_dict()
+        return {**base, **extra}
+
+    @property
+    def empty(self) -> bool:
+        return not self.records
+
+    def cheapest_hotel(self) -> dict | None:
+        hotels = [self.records[i] for i in self.hotel_ids]
+        return min(hotels, key=lambda h: h["cost"]) if hotels else None
+
+
+def build_vocab(df: pd.DataFrame) -> CategoryVocab:
+    return CategoryVocab(sorted(df["category"].dropna().unique()) if "category" in df.columns else [])
+
+
+def build_index(df: pd.DataFrame, vocab: CategoryVocab | None = None) -> dict[str, CityIndex]:
+    """Split the full catalogue into one CityIndex per city."""
+    if df.empty or "city" not in df.columns:
+        return {}
+    vocab = vocab or build_vocab(df)
+    return {city: CityIndex.build(city, rows, vocab) for city, rows in df.groupby("city", sort=False)}
@@ -1,12 +1,27 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import json
 import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
 import pandas as pd
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from cache import TTLCache
+from catalogue import CategoryVocab, CityIndex, build_index, build_vocab
+
 load_dotenv()
 
 _client: Client = None
 _locations_cache: pd.DataFrame | None = None  # module-level cache — locations never change
+_city_index: dict[str, CityIndex] = {}        # built alongside _locations_cache
+_category_vocab: CategoryVocab = CategoryVocab([])
 
 
 def get_client() -> Client:
@@ -20,6 +35,30 @@ def get_client() -> Client:
     return _client
 
 
+# ── Async access ──────────────────────────────────────────────────────────────
+# supabase-py is blocking, so async handlers hand every query to a dedicated,
+# fixed-size pool. DB_POOL_SIZE caps how many queries this process has in
+# flight; the event loop never blocks on the network, and independent queries
+# can be awaited together with asyncio.gather.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "16"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run(fn, *args, **kwargs):
+    """Run a blocking data-layer call on the DB pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def execute(query):
+    """Await a built supabase query: `await db.execute(client.table(...).select(...))`."""
+    return await run(query.execute)
+
+
+def ping():
+    get_client().table("trips").select("id").limit(1).execute()
+
+
 # ── Auth ──────────────────────────────────────────────────────────────────────
 
 def sign_up(email: str, password: str):
@@ -40,87 +79,370 @@ def get_user_from_token(token: str):
 
 def get_locations() -> pd.DataFrame:
     """Return locations DataFrame, fetching from Supabase only on first call."""
-    global _locations_cache
     if _locations_cache is not None and not _locations_cache.empty:
         return _locations_cache
     res = get_client().table("locations").select("*").execute()
     if res.data:
-        _locations_cache = pd.DataFrame(res.data)
+        set_locations(pd.DataFrame(res.data))
         return _locations_cache
     return pd.DataFrame()
 
 
+def set_locations(df: pd.DataFrame):
+    """Install an already-loaded catalogue (e.g. in engine worker processes)."""
+    global _locations_cache, _city_index, _category_vocab
+    _category_vocab = build_vocab(df)
+    _city_index = build_index(df, _category_vocab)
+    _locations_cache = df
+
+
+def get_city_index(city: str) -> CityIndex:
+    """Per-city view of the locations cache (empty index for unknown cities)."""
+    df = get_locations()
+    idx = _city_index.get(city)
+    if idx is None:
+        columns = df.columns if len(df.columns) else ["name", "city", "type", "category", "lat", "lon", "cost"]
+        idx = CityIndex.build(city, pd.DataFrame(columns=columns), _category_vocab)
+    return idx
+
+
+def get_category_vocab() -> CategoryVocab:
+    get_locations()
+    return _category_vocab
+
+
 # ── Trips ─────────────────────────────────────────────────────────────────────
 
-def get_trips(user_id: str) -> list[dict]:
+SLOT_ORDER = ["Breakfast ☕", "Morning 🌅", "Lunch 🍔", "Afternoon ☀️", "Dinner 🍷", "Evening 🌙"]
+_SLOT_RANK = {s: i for i, s in enumerate(SLOT_ORDER)}
+
+
+def _sort_spots(spots: list[dict]) -> list[dict]:
+    """Order spots by day_num, then slot order."""
+    spots.sort(key=lambda s: (s.get("day_num", 0), _SLOT_RANK.get(s.get("slot", ""), 99)))
+    return spots
+
+
+def _shape_trip(t: dict, spots: list[dict], fields: tuple[str, ...] | None = None) -> dict:
+    """Turn a `trips` row plus its spots into the API trip payload, optionally
+    keeping only `fields` (see TRIP_FIELDS)."""
+    trip = {
+        "id": t["id"],
+        "title": t.get("title"),
+        "city": t.get("city"),
+        "days": t.get("days"),
+        "cost": t.get("cost"),
+        "status": t.get("status", "Upcoming"),
+        "start_date": t.get("start_date"),
+        "end_date": t.get("end_date"),
+        "weather": {"condition": t.get("weather_condition"), "temp": t.get("weather_temp")},
+        "forecast": t.get("forecast") or {},
+        "spots": _sort_spots(spots),
+    }
+    return {f: trip[f] for f in fields} if fields else trip
+
+
+# Fields of the trip payload, and the `trips` columns each one is built from.
+TRIP_FIELDS = ("id", "title", "city", "days", "cost", "status",
+               "start_date", "end_date", "weather", "forecast", "spots")
+SUMMARY_FIELDS = ("id", "title", "city", "days", "cost", "status", "start_date", "end_date")
+_FIELD_COLUMNS = {"weather": ("weather_condition", "weather_temp"), "spots": ()}
+
+
+def _trip_columns(fields: tuple[str, ...] | None) -> str:
+    if not fields:
+        return "*"
+    cols = {"id", "created_at"}  # always needed for the page cursor
+    for f in fields:
+        cols.update(_FIELD_COLUMNS.get(f, (f,)))
+    return ", ".join(sorted(cols))
+
+
+def encode_cursor(*values) -> str:
+    """Opaque keyset cursor holding the sort key of the last row of a page."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: tuple[type, ...] = (str, str)) -> tuple:
+    """Inverse of encode_cursor, checked against the expected key `types`.
+    Raises ValueError for anything malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError):
+        raise ValueError("bad cursor") from None
+    if not (isinstance(values, list) and len(values) == len(types)
+            and all(type(v) is t for v, t in zip(values, types))):
+        raise ValueError("bad cursor")
+    return tuple(values)
+
+
+def get_trips(user_id: str, limit: int | None = None, after: tuple[str, str] | None = None,
+              fields: tuple[str, ...] | None = None) -> tuple[list[dict], str | None]:
     """
-    Load all trips for a user in 2 queries instead of 1 + N.
-    Query 1: fetch all trips for the user.
+    Load a user's trips, newest first, in at most 2 queries instead of 1 + N.
+    Query 1: fetch the trips (one keyset page of `limit` when given, starting
+    after the (created_at, id) position `after`).
     Query 2: fetch ALL spots for those trips in one go, then group in Python.
+    Skipped when `fields` leaves out "spots".
+    Returns the trips and the cursor of the next page (None on the last one).
     """
-    trips_res = (
+    query = (
         get_client().table("trips")
-        .select("*")
+        .select(_trip_columns(fields))
+        .eq("user_id", user_id)
+    )
+    if after:
+        created_at, trip_id = after
+        query = query.or_(f'created_at.lt."{created_at}",'
+                          f'and(created_at.eq."{created_at}",id.lt."{trip_id}")')
+    query = query.order("created_at", desc=True).order("id", desc=True)
+    if limit:
+        query = query.limit(limit + 1)  # one extra row tells us whether there's a next page
+    rows = query.execute().data or []
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    if not rows:
+        return [], None
+
+    trip_ids = [t["id"] for t in rows]
+    remember_owners(trip_ids, user_id)
+
+    spots_by_trip: dict[str, list] = {tid: [] for tid in trip_ids}
+    if not fields or "spots" in fields:
+        # Single query for all spots across all trips
+        spots_res = (
+            get_client().table("trip_spots")
+            .select("*")
+            .in_("trip_id", trip_ids)
+            .execute()
+        )
+        # Group spots by trip_id in Python
+        for spot in spots_res.data or []:
+            tid = spot.get("trip_id")
+            if tid in spots_by_trip:
+                spots_by_trip[tid].append(spot)
+
+    return [_shape_trip(t, spots_by_trip[t["id"]], fields) for t in rows], next_cursor
+
+
+def get_trip(trip_id: str, user_id: str) -> dict | None:
+    """One trip with its spots, in a single query. None if missing or not owned."""
+    res = (
+        get_client().table("trips")
+        .select("*, trip_spots(*)")
+        .eq("id", trip_id)
         .eq("user_id", user_id)
-        .order("created_at", desc=True)
         .execute()
     )
-    if not trips_res.data:
-        return []
+    if not res.data:
+        return None
+    t = res.data[0]
+    remember_owners([trip_id], user_id)
+    return _shape_trip(t, t.get("trip_spots") or [])
+
+
+def get_trip_spots(trip_id: str, user_id: str) -> list[dict] | None:
+    """The spots of one trip, in day/slot order. None if missing or not owned.
+    The ownership check is usually answered from the trip-owner cache."""
+    if trip_owner(trip_id) != user_id:
+        return None
+    res = get_client().table("trip_spots").select("*").eq("trip_id", trip_id).execute()
+    return _sort_spots(res.data or [])
+
+
+# ── Trip ownership ────────────────────────────────────────────────────────────
+# Trip endpoints filter their queries by user_id, so they need no separate
+# ownership read. Memories have no user_id of their own; for them a short-TTL
+# trip_id → owner cache, filled by every trip read and write, usually answers
+# the question without a round trip.
+TRIP_OWNER_TTL = 60
+_trip_owner = TTLCache(10_000, TRIP_OWNER_TTL)  # trip_id → user_id
+
+
+def remember_owners(trip_ids, user_id: str):
+    for tid in trip_ids:
+        _trip_owner.put(tid, user_id)
+
+
+def cached_trip_owner(trip_id: str) -> str | None:
+    return _trip_owner.get(trip_id)
+
+
+def trip_owner(trip_id: str) -> str | None:
+    """Owner of a trip (None if it doesn't exist), from the cache when fresh."""
+    owner = cached_trip_owner(trip_id)
+    if owner is None:
+        res = get_client().table("trips").select("user_id").eq("id", trip_id).execute()
+        if res.data:
+            owner = res.data[0]["user_id"]
+            remember_owners([trip_id], owner)
+    return owner
+
+
+def forget_owners(trip_ids=(), user_id: str | None = None):
+    """Drop cached owners for these trips, or for every trip of `user_id`."""
+    for tid in trip_ids:
+        _trip_owner.pop(tid)
+    if user_id:
+        _trip_owner.discard_where(lambda _tid, owner: owner == user_id)
+
+
+# ── Share snapshots ───────────────────────────────────────────────────────────
+# Public share links are read far more often than trips change, so each shared
+# trip is serialized once and kept as JSON bytes with a content-hash ETag.
+# Every write below that changes what a share shows drops its snapshot; the TTL
+# bounds staleness from writes made through another API instance.
+SHARE_CACHE_TTL = int(os.environ.get("SHARE_CACHE_TTL", "300"))
+_shares = TTLCache(2048, SHARE_CACHE_TTL)  # trip_id → ShareSnapshot
+_share_epoch = 0  # bumped on every invalidation, guards loads that raced one
+_share_lock = threading.Lock()
+
+
+class ShareSnapshot:
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def cached_share(trip_id: str) -> ShareSnapshot | None:
+    return _shares.get(trip_id)
 
-    trip_ids = [t["id"] for t in trips_res.data]
 
-    # Single query for all spots across all trips
-    spots_res = (
+def share_snapshot(trip_id: str) -> ShareSnapshot | None:
+    """Public view of a trip as pre-serialized JSON. None if it doesn't exist."""
+    snap = cached_share(trip_id)
+    if snap is not None:
+        return snap
+    epoch = _share_epoch
+    res = get_client().table("trips").select("*, trip_spots(*)").eq("id", trip_id).execute()
+    if not res.data:
+        return None
+    t = res.data[0]
+    remember_owners([trip_id], t["user_id"])
+    body = json.dumps(_shape_trip(t, t.get("trip_spots") or []),
+                      ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    snap = ShareSnapshot(body)
+    with _share_lock:
+        if epoch == _share_epoch:
+            _shares.put(trip_id, snap)
+    return snap
+
+
+def forget_shares(trip_ids):
+    global _share_epoch
+    with _share_lock:
+        _share_epoch += 1
+        for tid in trip_ids:
+            _shares.pop(tid)
+
+
+# ── Visited-spots cache ───────────────────────────────────────────────────────
+# user_id → {city: Counter of spot name → number of saved spots with that name}.
+# Loaded lazily per city on first use, then kept current by the write paths
+# below so trip generation rarely needs a history query once a user is warm.
+# The cache is per process: writes served by another worker don't reach it,
+# so entries expire VISITED_TTL seconds after they were created, which bounds
+# how stale a user's history can get.
+VISITED_TTL = int(os.environ.get("VISITED_TTL", "300"))
+_visited = TTLCache(10_000, VISITED_TTL)
+_visited_lock = threading.Lock()
+
+
+class _Visits:
+    __slots__ = ("cities", "gen")
+
+    def __init__(self):
+        self.cities: dict[str, Counter] = {}
+        self.gen = 0  # bumped by every write, guards lazy loads
+
+
+def get_visited_counts(user_id: str, city: str) -> Counter:
+    """Spot name → visit count across the user's trips to `city`."""
+    with _visited_lock:  # get-or-create under the lock writers bump gen with
+        entry = _visited.get(user_id)
+        if entry is None:
+            entry = _Visits()
+            _visited.put(user_id, entry)
+        cached = entry.cities.get(city)
+        gen = entry.gen
+    if cached is not None:
+        return Counter(cached)
+    res = (
         get_client().table("trip_spots")
-        .select("*")
-        .in_("trip_id", trip_ids)
+        .select("name, trips!inner(user_id, city)")
+        .eq("trips.user_id", user_id)
+        .eq("trips.city", city)
         .execute()
     )
-    all_spots = spots_res.data or []
+    counts = Counter(r["name"] for r in res.data or [])
+    with _visited_lock:
+        if entry.gen == gen:  # no write raced the query
+            entry.cities[city] = counts
+    return Counter(counts)
 
-    # Group spots by trip_id in Python
-    slot_order = ["Breakfast ☕", "Morning 🌅", "Lunch 🍔", "Afternoon ☀️", "Dinner 🍷", "Evening 🌙"]
-    slot_rank  = {s: i for i, s in enumerate(slot_order)}
 
-    spots_by_trip: dict[str, list] = {tid: [] for tid in trip_ids}
-    for spot in all_spots:
-        tid = spot.get("trip_id")
-        if tid in spots_by_trip:
-            spots_by_trip[tid].append(spot)
-
-    # Sort each trip's spots by day_num then slot order
-    for tid in spots_by_trip:
-        spots_by_trip[tid].sort(
-            key=lambda s: (s.get("day_num", 0), slot_rank.get(s.get("slot", ""), 99))
-        )
+def get_visited_names(user_id: str, city: str) -> set[str]:
+    """Names of every spot on any of the user's trips to `city`."""
+    return set(get_visited_counts(user_id, city))
+
+
+def update_visited(user_id: str, city: str | None, added=(), removed=()):
+    """Apply a trip write to the cache (no-op for cities not loaded yet)."""
+    with _visited_lock:
+        entry = _visited.get(user_id)
+        if entry is None:
+            return
+        entry.gen += 1
+        counts = entry.cities.get(city)
+        if counts is None:
+            return
+        counts.update(added)
+        counts.subtract(removed)
+        for name in [n for n, c in counts.items() if c <= 0]:
+            del counts[name]
+
+
+def _has_visited(user_id: str) -> bool:
+    entry = _visited.get(user_id)
+    return entry is not None and bool(entry.cities)
 
-    trips = []
-    for t in trips_res.data:
-        trips.append({
-            "id": t["id"],
-            "title": t["title"],
-            "city": t["city"],
-            "days": t["days"],
-            "cost": t["cost"],
-            "status": t.get("status", "Upcoming"),
-            "start_date": t.get("start_date"),
-            "end_date": t.get("end_date"),
-            "weather": {"condition": t["weather_condition"], "temp": t["weather_temp"]},
-            "forecast": t.get("forecast") or {},
-            "spots": spots_by_trip.get(t["id"], []),
-        })
-    return trips
 
+def forget_visited(user_id: str):
+    """Drop everything cached for a user (account deletion)."""
+    with _visited_lock:
+        _visited.pop(user_id)
 
-def save_trip(user_id: str, trip: dict) -> str:
+
+def spot_row(trip_id: str | None, spot: dict, city: str) -> dict:
+    """A generated spot as a `trip_spots` row."""
+    return {
+        "trip_id": trip_id,
+        "name": spot["name"],
+        "city": spot.get("city", city),
+        "category": spot["category"],
+        "type": spot.get("type", ""),
+        "lat": float(spot["lat"]),
+        "lon": float(spot["lon"]),
+        "cost": float(spot["cost"]),
+        "day_num": int(spot["day_num"]),
+        "slot": str(spot["slot"]),
+    }
+
+
+def _trip_row(user_id: str, trip: dict) -> dict:
     from datetime import date as date_type
     def to_str(d):
         if d is None: return None
         if isinstance(d, date_type): return d.isoformat()
         return str(d)
 
-    trip_row = {
+    return {
         "user_id": user_id,
         "title": trip["title"],
         "city": trip["city"],
@@ -133,33 +455,240 @@ def save_trip(user_id: str, trip: dict) -> str:
         "weather_temp": trip["weather"]["temp"],
         "forecast": trip.get("forecast", {}),
     }
-    res = get_client().table("trips").insert(trip_row).execute()
-    trip_id = res.data[0]["id"]
-
-    spots = trip.get("spots", [])
-    if spots:
-        rows = []
-        for row in spots:
-            rows.append({
-                "trip_id": trip_id,
-                "name": row["name"],
-                "city": row.get("city", trip["city"]),
-                "category": row["category"],
-                "type": row.get("type", ""),
-                "lat": float(row["lat"]),
-                "lon": float(row["lon"]),
-                "cost": float(row["cost"]),
-                "day_num": int(row["day_num"]),
-                "slot": str(row["slot"]),
-            })
-        get_client().table("trip_spots").insert(rows).execute()
-
-    return trip_id
-
-
-def delete_trip(trip_id: str):
-    get_client().table("trips").delete().eq("id", trip_id).execute()
-
-
-def update_trip_status(trip_id: str, status: str):
-    get_client().table("trips").update({"status": status}).eq("id", trip_id).execute()
+
+
+def save_trip(user_id: str, trip: dict) -> dict:
+    """Save a trip and its spots atomically; returns the stored trip with spot ids."""
+    return save_trips(user_id, [trip])[0]
+
+
+def save_trips(user_id: str, trips: list[dict]) -> list[dict]:
+    """
+    Save many trips in one call (imports, load tests). Uses the save_trips
+    Postgres function so every trip and spot lands in a single transaction;
+    without it, trips and spots go in as two bulk inserts and the trips are
+    deleted again if the spot insert fails, so nothing is left orphaned.
+    """
+    if not trips:
+        return []
+    items = [{
+        "trip": _trip_row(user_id, t),
+        "spots": [spot_row(None, sp, t["city"]) for sp in t.get("spots", [])],
+    } for t in trips]
+
+    data = _rpc("save_trips", {"p_trips": items})
+    if data is not None:
+        saved = [_shape_trip(row, row.pop("spots", None) or []) for row in data]
+    else:
+        client = get_client()
+        trip_rows = client.table("trips").insert([i["trip"] for i in items]).execute().data
+        ids = [t["id"] for t in trip_rows]
+        rows = [{**sp, "trip_id": tid} for tid, i in zip(ids, items) for sp in i["spots"]]
+        try:
+            spot_rows = client.table("trip_spots").insert(rows).execute().data if rows else []
+        except Exception:
+            client.table("trips").delete().in_("id", ids).execute()
+            raise
+        by_trip: dict[str, list] = {tid: [] for tid in ids}
+        for sp in spot_rows or []:
+            by_trip[sp["trip_id"]].append(sp)
+        saved = [_shape_trip(t, by_trip[t["id"]]) for t in trip_rows]
+
+    for t in saved:
+        update_visited(user_id, t["city"], added=[sp["name"] for sp in t["spots"]])
+    remember_owners([t["id"] for t in saved], user_id)
+    return saved
+
+
+def delete_trip(trip_id: str, user_id: str) -> bool:
+    """Delete one of the user's trips. False if it isn't theirs (or is gone)."""
+    city, removed = None, []
+    if _has_visited(user_id):
+        # Only read the spots back when there is a cache entry to decrement
+        res = (get_client().table("trips").select("city, trip_spots(name)")
+               .eq("id", trip_id).eq("user_id", user_id).execute())
+        if not res.data:
+            return False
+        city = res.data[0]["city"]
+        removed = [s["name"] for s in res.data[0].get("trip_spots") or []]
+    res = get_client().table("trips").delete().eq("id", trip_id).eq("user_id", user_id).execute()
+    forget_owners([trip_id])
+    forget_shares([trip_id])
+    if not res.data:
+        return False
+    update_visited(user_id, city, removed=removed)
+    return True
+
+
+def update_trip_status(trip_id: str, status: str, user_id: str) -> bool:
+    """Set the status of one of the user's trips. False if it isn't theirs."""
+    res = (get_client().table("trips").update({"status": status})
+           .eq("id", trip_id).eq("user_id", user_id).execute())
+    if not res.data:
+        return False
+    forget_shares([trip_id])
+    return True
+
+
+# ── Atomic multi-statement writes ─────────────────────────────────────────────
+# Postgres functions (see DOCUMENTATION.md) apply several statements in one
+# transaction and one round trip. Projects that haven't installed them fall
+# back to the equivalent individual statements.
+_rpc_missing: set[str] = set()
+
+
+def _is_missing_function(e: Exception) -> bool:
+    return getattr(e, "code", None) == "PGRST202" or "PGRST202" in str(e)
+
+
+def _rpc(name: str, params: dict, scalar: bool = False):
+    """Call a Postgres function; None if it isn't installed. Set-returning
+    calls get [] for no rows; `scalar` returns the value as sent."""
+    if name in _rpc_missing:
+        return None
+    try:
+        data = get_client().rpc(name, params).execute().data
+        return data if scalar else data or []
+    except Exception as e:
+        if _is_missing_function(e):
+            _rpc_missing.add(name)
+            return None
+        raise
+
+
+def replace_day_spots(trip_id: str, day_num: int, rows: list[dict], cost: float) -> list[dict]:
+    """Swap one day's spots for `rows` and set the trip cost. Returns the new rows."""
+    try:
+        data = _rpc("replace_trip_day", {
+            "p_trip_id": trip_id, "p_day_num": day_num, "p_spots": rows, "p_cost": cost,
+        })
+        if data is not None:
+            return data
+        client = get_client()
+        client.table("trip_spots").delete().eq("trip_id", trip_id).eq("day_num", day_num).execute()
+        inserted = client.table("trip_spots").insert(rows).execute().data if rows else []
+        client.table("trips").update({"cost": cost}).eq("id", trip_id).execute()
+        return inserted or []
+    finally:
+        forget_shares([trip_id])
+
+
+def swap_spot(trip_id: str, spot_id: str, updates: dict, cost: float | None) -> dict:
+    """Update one spot (and the trip cost, if given). Returns the updated row."""
+    try:
+        data = _rpc("swap_trip_spot", {
+            "p_trip_id": trip_id, "p_spot_id": spot_id, "p_spot": updates, "p_cost": cost,
+        })
+        if data is not None:
+            return data[0] if data else {}
+        client = get_client()
+        res = client.table("trip_spots").update(updates).eq("id", spot_id).eq("trip_id", trip_id).execute()
+        if cost is not None:
+            client.table("trips").update({"cost": cost}).eq("id", trip_id).execute()
+        return res.data[0] if res.data else {}
+    finally:
+        forget_shares([trip_id])
+
+
+# ── Signed image URLs ─────────────────────────────────────────────────────────
+# Memory images live in the private `memories` bucket. Their signed URLs are
+# minted in bulk, one storage call per batch of paths, and reused until
+# SIGNED_URL_MARGIN seconds before they expire.
+SIGNED_URL_TTL = int(os.environ.get("SIGNED_URL_TTL", "3600"))
+SIGNED_URL_MARGIN = 300
+_signed_urls = TTLCache(10_000, max(SIGNED_URL_TTL - SIGNED_URL_MARGIN, 0))  # path → url
+
+
+def signed_urls(paths) -> dict[str, str]:
+    """Signed URL for each storage path in the memories bucket (paths that
+    couldn't be signed are left out)."""
+    out, missing = {}, []
+    for path in dict.fromkeys(paths):
+        url = _signed_urls.get(path)
+        if url is not None:
+            out[path] = url
+        else:
+            missing.append(path)
+    if not missing:
+        return out
+
+    signed = get_client().storage.from_("memories").create_signed_urls(missing, SIGNED_URL_TTL)
+    for item in signed:
+        if item.get("error") or not item.get("signedURL"):
+            continue
+        out[item["path"]] = item["signedURL"]
+        _signed_urls.put(item["path"], item["signedURL"])
+    return out
+
+
+def forget_signed_url(path: str):
+    _signed_urls.pop(path)
+
+
+# ── Delta sync ────────────────────────────────────────────────────────────────
+# trips, trip_spots and memories carry an updated_at kept current by a trigger,
+# and deletes leave a row in `tombstones` (see DOCUMENTATION.md), so a client
+# can ask for just what changed since its last watermark. The sync_changes
+# function reads everything in one snapshot and returns the database's now()
+# with it, so the watermark is on the same clock as updated_at. A transaction
+# that commits late stamps its rows with its start time, so the watermark
+# handed out trails now() by SYNC_OVERLAP seconds: recent changes may be sent
+# twice, and clients apply the repeats like any other change. Write
+# transactions running longer than SYNC_OVERLAP can still be missed.
+SYNC_OVERLAP = float(os.environ.get("SYNC_OVERLAP", "2"))
+TOMBSTONE_DAYS = 30  # matches the prune in the tombstone trigger
+_SYNC_FIELDS = tuple(f for f in TRIP_FIELDS if f != "spots")
+
+
+def _owned_rows(rows: list[dict]) -> list[dict]:
+    for r in rows:
+        r.pop("trips", None)  # the embed only exists to filter on the owner
+    return rows
+
+
+async def _read_changes(user_id: str, since: datetime | None):
+    """(now, trips, spots, memories, tombstones) without sync_changes: separate
+    queries, with the API server's clock standing in for the database's."""
+    client = get_client()
+    now = datetime.now(timezone.utc)
+    queries = [
+        client.table("trips").select("*").eq("user_id", user_id),
+        client.table("trip_spots").select("*, trips!inner(user_id)").eq("trips.user_id", user_id),
+        client.table("memories").select("*, trips!inner(user_id)").eq("trips.user_id", user_id),
+    ]
+    if since:
+        queries = [q.gt("updated_at", since.isoformat()) for q in queries]
+        queries.append(client.table("tombstones").select("entity, entity_id")
+                       .eq("user_id", user_id).gt("deleted_at", since.isoformat()))
+    results = await asyncio.gather(*(execute(q) for q in queries))
+    trips, spots, memories = (res.data or [] for res in results[:3])
+    return now, trips, spots, memories, (results[3].data or []) if since else []
+
+
+async def get_changes(user_id: str, since: datetime | None) -> dict:
+    """Trips, spots and memories changed after `since` (everything when None),
+    the ids deleted after it, and the watermark to pass next time."""
+    data = await run(_rpc, "sync_changes", {"p_user_id": user_id,
+                                            "p_since": since.isoformat() if since else None})
+    if data is None:
+        now, trips, spots, memories, tombstones = await _read_changes(user_id, since)
+    else:
+        now = pd.Timestamp(data["now"]).tz_convert("UTC").to_pydatetime()
+        trips, spots, memories = data["trips"] or [], data["spots"] or [], data["memories"] or []
+        tombstones = data["deleted"] or []
+    watermark = now - timedelta(seconds=SYNC_OVERLAP)
+
+    deleted = {"trips": [], "spots": [], "memories": []}
+    for t in tombstones:
+        deleted.setdefault(t["entity"], []).append(t["entity_id"])
+    if trips:
+        remember_owners([t["id"] for t in trips], user_id)
+    return {
+        # UTC with a Z suffix, so it survives a query string without escaping
+        "watermark": watermark.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "reset": since is None,
+        "trips": [{**_shape_trip(t, [], _SYNC_FIELDS), "updated_at": t.get("updated_at")} for t in trips],
+        "spots": _sort_spots(_owned_rows(spots)),
+        "memories": _owned_rows(memories),
+        "deleted": deleted,
+    }
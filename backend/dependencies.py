@@ -1,5 +1,70 @@
-from fastapi import Header, HTTPException
+import hashlib
+import os
+import time
+
+import jwt
+from fastapi import Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 import db
+from cache import TTLCache
+
+# ── Token verification ────────────────────────────────────────────────────────
+# Supabase access tokens are JWTs, so most requests can be verified locally
+# with the project's JWT secret (HS256) or its published JWKS (RS256/ES256).
+# Verified tokens are cached by hash until their own `exp`. The Supabase Auth
+# round trip is only used when local verification can't decide (no secret
+# configured, unknown key id, JWKS unreachable). Local verification runs on
+# the threadpool: the JWKS client fetches keys with blocking urllib calls (first
+# use, hourly refresh, unknown kid), which must not stall the event loop.
+
+_token_cache = TTLCache(4096)  # sha256 → user_id, kept until the token's exp
+_jwks_client: jwt.PyJWKClient | None = None
+
+
+class _Inconclusive(Exception):
+    """Local verification could not decide — ask Supabase Auth."""
+
+
+def _signing_key(token: str, alg: str):
+    global _jwks_client
+    if alg.startswith("HS"):
+        secret = os.environ.get("SUPABASE_JWT_SECRET")
+        if not secret:
+            raise _Inconclusive()
+        return secret
+    url = os.environ.get("SUPABASE_URL")
+    if not url:
+        raise _Inconclusive()
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(f"{url.rstrip('/')}/auth/v1/.well-known/jwks.json", lifespan=3600)
+    try:
+        return _jwks_client.get_signing_key_from_jwt(token).key
+    except jwt.PyJWKClientError as e:
+        raise _Inconclusive() from e
+
+
+def _verify_locally(token: str) -> dict:
+    """Return the verified claims. Raises jwt.InvalidTokenError for a token
+    that is definitely bad, _Inconclusive when we can't tell."""
+    alg = jwt.get_unverified_header(token).get("alg", "")
+    if alg not in ("HS256", "RS256", "ES256"):
+        raise _Inconclusive()
+    return jwt.decode(
+        token, _signing_key(token, alg), algorithms=[alg],
+        audience="authenticated", options={"require": ["exp", "sub"]},
+    )
+
+
+async def _verify_remotely(token: str) -> tuple[str, float]:
+    result = await run_in_threadpool(db.get_user_from_token, token)
+    if not (result and result.user):
+        raise HTTPException(status_code=401, detail="Invalid or expired token.")
+    try:
+        exp = float(jwt.decode(token, options={"verify_signature": False}).get("exp", 0))
+    except jwt.InvalidTokenError:
+        exp = 0.0  # not worth caching if we can't read the expiry
+    return result.user.id, exp
+
 
 async def get_current_user_id(authorization: str = Header(...)) -> str:
     """
@@ -9,12 +74,31 @@ async def get_current_user_id(authorization: str = Header(...)) -> str:
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header format.")
     token = authorization[7:]
+    key = hashlib.sha256(token.encode()).hexdigest()
+    user_id = _token_cache.get(key)
+    if user_id:
+        return user_id
     try:
-        result = db.get_user_from_token(token)
-        if result and result.user:
-            return result.user.id
-        raise HTTPException(status_code=401, detail="Invalid or expired token.")
+        try:
+            claims = await run_in_threadpool(_verify_locally, token)
+            user_id, exp = claims["sub"], float(claims["exp"])
+        except _Inconclusive:
+            user_id, exp = await _verify_remotely(token)
     except HTTPException:
         raise
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token.")
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Could not validate credentials: {e}")
+    if exp > time.time():
+        _token_cache.put(key, user_id, ttl=exp - time.time())
+    return user_id
+
+
+async def require_admin(user_id: str = Depends(get_current_user_id)) -> str:
+    """Operator-only routes: the caller must be listed in ADMIN_USER_IDS
+    (comma-separated Supabase user ids)."""
+    admins = {u.strip() for u in os.environ.get("ADMIN_USER_IDS", "").split(",") if u.strip()}
+    if user_id not in admins:
+        raise HTTPException(status_code=403, detail="Admin access required.")
+    return user_id
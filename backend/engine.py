@@ -0,0 +1,150 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, NamedTuple
+
+import db
+import itinerary as itin
+from cache import TTLCache
+
+# ── Itinerary engine ──────────────────────────────────────────────────────────
+# Building an itinerary is CPU-bound Python/pandas work that holds the GIL, so
+# threads serialize on it under load. With ENGINE_MODE=process it runs on a
+# pool of worker processes instead. Each worker is handed the catalogue once
+# by its initializer and builds its own city indexes; after that a request
+# only ships a small PlanParams tuple over and gets the spot list back.
+
+ENGINE_MODE    = os.environ.get("ENGINE_MODE", "thread")  # "thread" | "process"
+ENGINE_WORKERS = int(os.environ.get("ENGINE_WORKERS", str(os.cpu_count() or 2)))
+
+
+class PlanParams(NamedTuple):
+    city: str
+    days: int
+    rest_mode: bool
+    previously_used: frozenset = frozenset()
+    exclude_visited: bool = False
+    chosen_hotel: str | None = None
+    user_preferences: tuple = ()
+    pinned_spot: str | None = None
+    rainy_days: frozenset = frozenset()
+    max_activity_cost: float | None = None  # per-day cap on non-hotel spots
+    seed: int | None = None                 # reproducible (and cacheable) when set
+
+
+def _within_cap(cost, cap: float) -> bool:
+    """A spot fits the activity cap only with a known cost: unknown (None /
+    NaN) costs are left out, as they always were for NaN."""
+    return cost is not None and cost == cost and cost <= cap
+
+
+def plan(p: PlanParams) -> list[dict]:
+    """Build one itinerary in this process from the cached catalogue."""
+    city = db.get_city_index(p.city)
+    candidates = None
+    if p.user_preferences or p.max_activity_cost is not None:
+        prefs, cap = set(p.user_preferences), p.max_activity_cost
+        candidates = [l.id for l in city.locs
+                      if (not prefs or l.category in prefs) and (cap is None or _within_cap(l.cost, cap))]
+    return itin.organize_itinerary(
+        candidates=candidates, days=p.days, city_index=city, rest_mode=p.rest_mode,
+        previously_used=set(p.previously_used), exclude_visited=p.exclude_visited,
+        chosen_hotel=p.chosen_hotel, pinned_spot=p.pinned_spot, rainy_days=set(p.rainy_days),
+        seed=p.seed,
+    )
+
+
+# ── Plan cache ────────────────────────────────────────────────────────────────
+# A seeded plan is a pure function of its parameters, so results are cached
+# under a hash of them (the visited set enters the key as its own hash, and
+# only when exclude_visited makes it matter).
+# Unseeded plans are random by design and never cached.
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", "1024"))
+_plan_cache = TTLCache(PLAN_CACHE_SIZE)  # plan_key → spots
+
+
+def _sha(value) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False).encode()).hexdigest()
+
+
+def plan_key(p: PlanParams) -> str:
+    """Content address of a plan's parameters."""
+    visited = _sha(sorted(p.previously_used)) if p.exclude_visited and p.previously_used else None
+    return _sha([
+        p.city, p.days, p.rest_mode, p.exclude_visited, p.chosen_hotel,
+        sorted(p.user_preferences), p.pinned_spot, sorted(p.rainy_days),
+        p.max_activity_cost, p.seed, visited,
+    ])
+
+
+def _cache_get(key: str) -> list[dict] | None:
+    hit = _plan_cache.get(key)
+    return [dict(s) for s in hit] if hit is not None else None  # callers stamp day numbers
+
+
+def _cache_put(key: str, spots: list[dict]):
+    _plan_cache.put(key, [dict(s) for s in spots])
+
+
+# ── Process pool ──────────────────────────────────────────────────────────────
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()  # concurrent first requests must not each start a pool
+
+
+def _init_worker(locations):
+    db.set_locations(locations)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    pool = _pool
+    if pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # forkserver/spawn rather than fork: the API process has live threads
+                method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+                ctx = mp.get_context(method)
+                if method == "forkserver":
+                    ctx.set_forkserver_preload(["engine"])
+                _pool = ProcessPoolExecutor(max_workers=ENGINE_WORKERS, mp_context=ctx,
+                                            initializer=_init_worker, initargs=(db.get_locations(),))
+            pool = _pool
+    return pool
+
+
+def generate(p: PlanParams) -> list[dict]:
+    """Build one itinerary, on the process pool when ENGINE_MODE=process.
+    Seeded plans are served from the plan cache when possible."""
+    key = plan_key(p) if p.seed is not None else None
+    if key and (hit := _cache_get(key)) is not None:
+        return hit
+    spots = _get_pool().submit(plan, p).result() if ENGINE_MODE == "process" else plan(p)
+    if key:
+        _cache_put(key, spots)
+    return spots
+
+
+def generate_many(params: Iterable[PlanParams], chunksize: int = 4) -> list[list[dict]]:
+    """Build many itineraries in parallel across cores (precomputation, A/B
+    runs). Always uses the process pool, whatever ENGINE_MODE says; seeded
+    plans go through the plan cache."""
+    params = list(params)
+    keys = [plan_key(p) if p.seed is not None else None for p in params]
+    out: list[list[dict] | None] = [_cache_get(k) if k else None for k in keys]
+    todo = [i for i, spots in enumerate(out) if spots is None]
+    for i, spots in zip(todo, _get_pool().map(plan, [params[i] for i in todo], chunksize=chunksize)):
+        out[i] = spots
+        if keys[i]:
+            _cache_put(keys[i], spots)
+    return out
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -1,94 +1,296 @@
+from __future__ import annotations
+
+import asyncio
+import json
 import os
 import random
 import math
+import time
+from collections import deque
 from datetime import date, timedelta, datetime
+from typing import TYPE_CHECKING, Iterable
 
+import httpx
 import numpy as np
-import pandas as pd
-import requests
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics.pairwise import cosine_similarity
+
+from cache import TTLCache
+
+# pandas (and the catalogue, which needs it) are only imported where a
+# DataFrame is actually handled, so budget/status callers stay light.
+if TYPE_CHECKING:
+    import pandas as pd
+    from catalogue import CategoryVocab, CityIndex, Location
 
 
 # ── Weather ───────────────────────────────────────────────────────────────────
+# One 5-day/3-hour forecast call per city gives everything the generator
+# needs: the current condition, the per-day summary stored with the trip and a
+# per-slot grid for the rain filter. Calls go through one pooled async HTTP
+# client, a bounded LRU + TTL cache (optionally saved to disk so restarts stay
+# warm) and single-flight fetches: concurrent requests for the same city share
+# one outbound call. Entries past their TTL are still served for up to
+# _WEATHER_STALE seconds while a refresh runs in the background.
 WEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "")
-_weather_cache: dict[str, tuple] = {}
-_WEATHER_TTL = 600  # seconds
+WEATHER_BASE_URL = "http://api.openweathermap.org/data/2.5"
+_WEATHER_TTL = 600          # seconds an entry counts as fresh
+_WEATHER_STALE = 3600       # seconds past TTL an entry may still be served
+_WEATHER_CACHE_SIZE = int(os.environ.get("WEATHER_CACHE_SIZE", "512"))
+_WEATHER_CACHE_FILE = os.environ.get("WEATHER_CACHE_FILE", "")  # empty = memory only
+_WEATHER_SAVE_DELAY = 5     # seconds changes are batched before the file is rewritten
+
+
+class _WeatherCache:
+    """LRU cache of (value, stored_at) with TTL and stale window, optionally
+    saved to a JSON file.
+
+    File I/O never runs on the event loop: the file is read once at startup
+    (load) and rewritten in a worker thread at most every _WEATHER_SAVE_DELAY
+    seconds after a change, plus once more at shutdown (flush)."""
+
+    def __init__(self, maxsize: int, path: str = ""):
+        self.path = path
+        self._data = TTLCache(maxsize, _WEATHER_TTL + _WEATHER_STALE)  # key → (value, stored_at)
+        self._save_task: asyncio.Task | None = None
+        self._dirty = False
+
+    def get(self, key: str) -> tuple | None:
+        """(value, is_fresh) or None if missing / too old to serve."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return entry[0], time.time() - entry[1] <= _WEATHER_TTL
+
+    def put(self, key: str, value) -> None:
+        self._data.put(key, (value, time.time()))
+        if self.path:
+            self._dirty = True
+            if self._save_task is None or self._save_task.done():
+                self._save_task = asyncio.ensure_future(self._save_later())
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def load(self) -> None:
+        if self.path:
+            await asyncio.to_thread(self._load)
+
+    async def flush(self) -> None:
+        """Cancel any pending save and write the current entries now."""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        if self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._save, dict(self._data.items()))
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(_WEATHER_SAVE_DELAY)
+        self._save_task = None
+        await self.flush()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                raw = json.load(f)
+            now = time.time()
+            for key, (value, stored_at) in sorted(raw.items(), key=lambda kv: kv[1][1]):
+                left = _WEATHER_TTL + _WEATHER_STALE - (now - stored_at)
+                if left > 0 and self._data.get(key) is None:  # never clobber a fresher fetch
+                    self._data.put(key, (value, stored_at), ttl=left)
+        except Exception:
+            pass  # a corrupt cache file just means a cold start
+
+    def _save(self, snapshot: dict) -> None:
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+
+_weather_cache = _WeatherCache(_WEATHER_CACHE_SIZE, _WEATHER_CACHE_FILE)
+_weather_inflight: dict[str, asyncio.Task] = {}
+_http_client: httpx.AsyncClient | None = None
+
+
+def _client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=WEATHER_BASE_URL,
+            timeout=5,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _http_client
 
 
-def _weather_cached(key: str):
-    """Return cached value if still fresh, else None."""
-    entry = _weather_cache.get(key)
-    if entry and datetime.now().timestamp() < entry[1]:
-        return entry[0]
-    return None
+async def load_weather_cache() -> None:
+    await _weather_cache.load()
 
 
-def _weather_store(key: str, value):
-    _weather_cache[key] = (value, datetime.now().timestamp() + _WEATHER_TTL)
-    return value
+async def close_weather_client() -> None:
+    """Close the pooled HTTP client and write out the forecast cache."""
+    global _http_client
+    await _weather_cache.flush()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 
-def get_weather_status(city: str) -> tuple[str, float | None]:
-    key = f"current:{city.lower()}"
-    cached = _weather_cached(key)
-    if cached is not None:
-        return cached
-    try:
-        url = (
-            f"http://api.openweathermap.org/data/2.5/weather"
-            f"?q={city}&appid={WEATHER_API_KEY}&units=metric"
-        )
-        r = requests.get(url, timeout=5).json()
-        if r.get("cod") == 200:
-            result = r["weather"][0]["main"], r["main"]["temp"]
-            return _weather_store(key, result)
-        return "Unknown", None
-    except Exception:
-        return "Unknown", None
+async def _call(endpoint: str, city: str) -> dict:
+    r = await _client().get(endpoint, params={"q": city, "appid": WEATHER_API_KEY, "units": "metric"})
+    return r.json()
 
 
-def get_forecast(city: str) -> dict:
-    key = f"forecast:{city.lower()}"
-    cached = _weather_cached(key)
-    if cached is not None:
-        return cached
-    try:
-        url = (
-            f"http://api.openweathermap.org/data/2.5/forecast"
-            f"?q={city}&appid={WEATHER_API_KEY}&units=metric"
-        )
-        r = requests.get(url, timeout=5).json()
-        if r.get("cod") != "200":
-            return {}
-        daily = {}
-        for item in r["list"]:
-            d = item["dt_txt"].split(" ")[0]
+SLOTS = ["Breakfast ☕", "Morning 🌅", "Lunch 🍔", "Afternoon ☀️", "Dinner 🍷", "Evening 🌙"]
+SLOT_HOURS = {"Breakfast ☕": 8, "Morning 🌅": 10, "Lunch 🍔": 13,
+              "Afternoon ☀️": 15, "Dinner 🍷": 19, "Evening 🌙": 21}
+SIGHT_SLOTS = ("Morning 🌅", "Afternoon ☀️", "Evening 🌙")
+RAIN_CONDITIONS = ("Rain", "Drizzle", "Thunderstorm")
+
+
+class CityWeather:
+    """Parsed forecast for one city.
+
+    current — (condition, temp) of the first forecast step
+    daily   — {date: (condition, rounded temp)}, first step of each day;
+              the shape stored with every trip as `forecast`
+    slots   — {date: {slot: condition}}, nearest step to each slot's hour
+    """
+
+    def __init__(self, current: tuple[str, float | None] = ("Unknown", None),
+                 daily: dict | None = None, slots: dict | None = None):
+        self.current = tuple(current)
+        self.daily = daily or {}
+        self.slots = slots or {}
+
+    @classmethod
+    def from_forecast(cls, r: dict) -> "CityWeather":
+        items = r["list"]
+        first = items[0]
+        daily: dict[str, tuple] = {}
+        steps: dict[str, list[tuple[int, str]]] = {}
+        for item in items:
+            d, t = item["dt_txt"].split(" ")
+            cond = item["weather"][0]["main"]
             if d not in daily:
-                daily[d] = (item["weather"][0]["main"], round(item["main"]["temp"]))
-        return _weather_store(key, daily)
+                daily[d] = (cond, round(item["main"]["temp"]))
+            steps.setdefault(d, []).append((int(t[:2]), cond))
+        slots = {
+            d: {slot: min(day, key=lambda st: abs(st[0] - hour))[1] for slot, hour in SLOT_HOURS.items()}
+            for d, day in steps.items()
+        }
+        return cls((first["weather"][0]["main"], first["main"]["temp"]), daily, slots)
+
+    def to_dict(self) -> dict:
+        return {"current": list(self.current), "daily": self.daily, "slots": self.slots}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CityWeather":
+        return cls(data["current"], {d: tuple(v) for d, v in data["daily"].items()}, data["slots"])
+
+    def condition_at(self, day: date, slot: str) -> str | None:
+        return self.slots.get(day.isoformat(), {}).get(slot)
+
+    def rainy_days(self, start: date | None, days: int) -> set[int]:
+        """Trip day numbers whose sightseeing slots are forecast to be wet.
+        Today falls back to the current condition once its steps have passed;
+        days beyond the forecast window are never filtered."""
+        start = start or date.today()
+        rainy = set()
+        for n in range(1, days + 1):
+            day = start + timedelta(days=n - 1)
+            conds = [self.condition_at(day, slot) for slot in SIGHT_SLOTS]
+            if day == date.today() and not any(conds):
+                conds = [self.current[0]]
+            if any(c in RAIN_CONDITIONS for c in conds):
+                rainy.add(n)
+        return rainy
+
+
+async def _fetch_forecast(city: str):
+    r = await _call("/forecast", city)
+    if r.get("cod") != "200" or not r.get("list"):
+        return None
+    return CityWeather.from_forecast(r).to_dict()
+
+
+async def _refresh(key: str, fetch, city: str):
+    """Run one fetch and store the result; None (failure) is never cached."""
+    try:
+        value = await fetch(city)
     except Exception:
-        return {}
+        value = None
+    finally:
+        _weather_inflight.pop(key, None)
+    if value is not None:
+        _weather_cache.put(key, value)
+    return value
+
+
+def _single_flight(key: str, fetch, city: str) -> asyncio.Task:
+    task = _weather_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_refresh(key, fetch, city))
+        _weather_inflight[key] = task
+    return task
+
+
+async def _cached_fetch(key: str, fetch, city: str):
+    hit = _weather_cache.get(key)
+    if hit is not None:
+        value, fresh = hit
+        if not fresh:
+            _single_flight(key, fetch, city)  # stale-while-revalidate
+        return value
+    # shield: one caller giving up must not cancel the fetch for the others
+    return await asyncio.shield(_single_flight(key, fetch, city))
+
+
+async def get_weather(city: str) -> CityWeather:
+    """Current conditions, daily summary and slot grid from one forecast call."""
+    # v2: the CityWeather.to_dict shape; bump when it changes so entries a
+    # persisted cache file holds in an older shape are never read back.
+    value = await _cached_fetch(f"forecast:v2:{city.lower()}", _fetch_forecast, city)
+    return CityWeather.from_dict(value) if value is not None else CityWeather()
 
 
 # ── Budget ────────────────────────────────────────────────────────────────────
+DAILY_BASE = 40  # flat per-day allowance on top of hotel + activities
+
+
+def _budget_terms(spots: list[dict]) -> tuple[float, float]:
+    """(hotel nightly rate, activity total) — the most expensive hotel row, plus
+    every other spot counted once per (day_num, name). Missing costs are skipped."""
+    hotel_nightly = 0.0
+    activity_sum  = 0.0
+    seen: set = set()
+    for s in spots:
+        if s.get("category") == "Hotel":
+            cost = s.get("cost")
+            if cost is not None and cost == cost:  # not None / NaN
+                hotel_nightly = max(hotel_nightly, float(cost))
+            continue
+        key = (s.get("day_num"), s.get("name"))
+        if key in seen:
+            continue
+        seen.add(key)
+        cost = s.get("cost")
+        if cost is not None and cost == cost:
+            activity_sum += float(cost)
+    return hotel_nightly, activity_sum
+
+
 def predict_total_budget(num_days: int, spots: list[dict]) -> float:
+    """hotel_nightly * days + activities + DAILY_BASE * days, rounded to cents."""
     if not spots:
         return 0.0
-    df = pd.DataFrame(spots)
-    hotel_rows = df[df["category"] == "Hotel"]
-    hotel_nightly = hotel_rows["cost"].max() if not hotel_rows.empty else 0
-    non_hotel = df[df["category"] != "Hotel"].drop_duplicates(subset=["day_num", "name"])
-    activity_sum = non_hotel["cost"].sum()
-    daily_base = 40
-
-    days_arr = np.array([[num_days - 1], [num_days], [num_days + 1]])
-    costs_arr = np.array([
-        hotel_nightly * d + activity_sum + daily_base * d
-        for d in [num_days - 1, num_days, num_days + 1]
-    ])
-    model = LinearRegression().fit(days_arr, costs_arr)
-    return round(float(model.predict([[num_days]])[0]), 2)
+    hotel_nightly, activity_sum = _budget_terms(spots)
+    return round(hotel_nightly * num_days + activity_sum + DAILY_BASE * num_days, 2)
 
 
 # ── Status ────────────────────────────────────────────────────────────────────
@@ -107,274 +309,277 @@ def compute_status(start_dt, days: int) -> str:
 
 
 # ── Recommendation ────────────────────────────────────────────────────────────
-def score_spots(spots_df: pd.DataFrame, user_preferences: list[str]) -> pd.DataFrame:
+def score_codes(codes: np.ndarray, pref_matrix: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity between one-hot category vectors and each user's
+    preference vector, worked out directly from category ids.
+    codes: (N,) ids from CategoryVocab.encode; pref_matrix: (U, V + 1).
+    Returns a (U, N) score matrix.
+
+    A spot's one-hot vector has norm 1, so its similarity to a user is
+    1/sqrt(m) when its category is preferred and 0 otherwise, where m is
+    the number of preferred categories actually present among the spots.
+    Users with m == 0 score every spot 1.0, as before.
+    """
+    n_cols = pref_matrix.shape[1]
+    present = np.bincount(codes, minlength=n_cols)[:n_cols] > 0
+    present[-1] = False  # unknown categories are never preferred
+    m = pref_matrix @ present
+    scores = pref_matrix[:, codes] / np.sqrt(np.maximum(m, 1))[:, None]
+    scores[m == 0] = 1.0
+    return scores
+
+
+def score_spots_batch(spots_df: pd.DataFrame, preferences: list[list[str]],
+                      vocab: CategoryVocab | None = None) -> np.ndarray:
+    """Score every spot for several users at once -> (len(preferences), len(spots_df))."""
+    from catalogue import build_vocab
+    vocab = vocab or build_vocab(spots_df)
+    codes = vocab.encode(spots_df["category"]) if len(spots_df) else np.empty(0, dtype=np.intp)
+    return score_codes(codes, vocab.preference_matrix(preferences))
+
+
+def score_spots(spots_df: pd.DataFrame, user_preferences: list[str],
+                vocab: CategoryVocab | None = None) -> pd.DataFrame:
     if spots_df.empty or not user_preferences:
         spots_df = spots_df.copy()
         spots_df["rec_score"] = 1.0
         return spots_df
 
-    all_categories = spots_df["category"].unique().tolist()
-    user_vec = np.array([[1 if cat in user_preferences else 0 for cat in all_categories]])
-    spot_vecs = np.array([
-        [1 if row["category"] == cat else 0 for cat in all_categories]
-        for _, row in spots_df.iterrows()
-    ])
-
-    if user_vec.sum() == 0 or spot_vecs.sum() == 0:
-        scores = np.ones(len(spots_df))
-    else:
-        scores = cosine_similarity(user_vec, spot_vecs)[0]
-
     spots_df = spots_df.copy()
-    spots_df["rec_score"] = scores
+    spots_df["rec_score"] = score_spots_batch(spots_df, [user_preferences], vocab)[0]
     return spots_df.sort_values("rec_score", ascending=False)
 
 
 # ── Distance helper ───────────────────────────────────────────────────────────
-def _geo_dist(a: dict, b: dict) -> float:
-    dlat = a["lat"] - b["lat"]
-    dlon = (a["lon"] - b["lon"]) * math.cos(math.radians(a["lat"]))
+def _geo_dist(a: Location, b: Location) -> float:
+    dlat = a.lat - b.lat
+    dlon = (a.lon - b.lon) * math.cos(math.radians(a.lat))
     return math.sqrt(dlat ** 2 + dlon ** 2)
 
 
-def _weighted_pick(pool: list[dict], current_loc: dict) -> dict:
-    weights = [1.0 / max(_geo_dist(current_loc, s), 0.001) for s in pool]
-    return random.choices(pool, weights=weights, k=1)[0]
+def _weighted_pick(mask: np.ndarray, current_loc: Location, city_index: CityIndex,
+                   rng: random.Random) -> Location:
+    """Pick a spot among the ids set in `mask` with probability proportional
+    to 1 / distance from `current_loc` (floored at 0.001), over the whole
+    pool. Same weights, same cumulative draw and same rng call as
+    random.choices, just computed on the city's coordinate arrays."""
+    ids = np.flatnonzero(mask)
+    lat, lon = city_index.grid.lat[ids], city_index.grid.lon[ids]
+    dlat = current_loc.lat - lat
+    dlon = (current_loc.lon - lon) * math.cos(math.radians(current_loc.lat))
+    cum = np.cumsum(1.0 / np.maximum(np.sqrt(dlat ** 2 + dlon ** 2), 0.001))
+    i = int(np.searchsorted(cum, rng.random() * cum[-1], side="right"))
+    return city_index.locs[ids[min(i, len(ids) - 1)]]
 
 
 # ── Itinerary Builder ─────────────────────────────────────────────────────────
+# Availability is kept as boolean arrays over the city's record ids, so every
+# fallback tier below is a handful of vectorized ANDs and the pick weighs the
+# whole pool in one array pass. "Used" state is tracked per name id and
+# mirrored onto every record carrying that name.
+RECENT_WINDOW = 4
+
+
 def organize_itinerary(
-    filtered_df: pd.DataFrame,
+    candidates: Iterable[int] | None,
     days: int,
-    target_city: str,
-    full_database: pd.DataFrame,
+    city_index: CityIndex,
     rest_mode: bool,
     previously_used: set | None = None,
     exclude_visited: bool = False,
     chosen_hotel: str | None = None,
-    user_preferences: list[str] | None = None,
     pinned_spot: str | None = None,
+    rainy_days: set[int] | None = None,
+    seed: int | None = None,
 ) -> list[dict]:
-    if previously_used is None:
-        previously_used = set()
+    """
+    candidates: ids into city_index.locs that may be used for sightseeing
+    (None = the whole city). previously_used: spot names.
+    rainy_days: day numbers on which sightseeing prefers Indoor spots.
+    seed: makes the result reproducible; None draws a fresh one.
+    """
+    from catalogue import Location
+
+    rng = random.Random(seed)
+
+    locs = city_index.locs
+    ids_by_name = city_index.ids_by_name
+    n = len(locs)
+    rainy_days = rainy_days or set()
 
     # ── Resolve pinned spot ───────────────────────────────────────────────────
-    pinned_row: dict | None = None
-    if pinned_spot:
-        pin_match = full_database[
-            (full_database["city"] == target_city) & (full_database["name"] == pinned_spot)
-        ]
-        if not pin_match.empty:
-            pinned_row = pin_match.iloc[0].to_dict()
+    pinned: Location | None = locs[ids_by_name[pinned_spot]] if pinned_spot in ids_by_name else None
 
     # ── Resolve hotel ─────────────────────────────────────────────────────────
-    hotel_pool = full_database[
-        (full_database["city"] == target_city) & (full_database["category"] == "Hotel")
-    ]
-    if chosen_hotel:
-        hotel_row = hotel_pool[hotel_pool["name"] == chosen_hotel]
-        hotel = hotel_row.iloc[0].to_dict() if not hotel_row.empty else hotel_pool.iloc[0].to_dict()
-    elif not hotel_pool.empty:
-        hotel = hotel_pool.iloc[0].to_dict()
+    hotel_ids = city_index.hotel_ids
+    if hotel_ids:
+        hotel = locs[hotel_ids[0]]
+        if chosen_hotel:
+            hotel = next((locs[i] for i in hotel_ids if locs[i].name == chosen_hotel), hotel)
     else:
-        hotel = {
-            "name": "Central Hotel",
-            "lat": full_database[full_database["city"] == target_city]["lat"].mean(),
-            "lon": full_database[full_database["city"] == target_city]["lon"].mean(),
-            "category": "Hotel",
-            "cost": 0,
-        }
-
-    # ── Zone filtering  ──────────────────
-    city_db = full_database[full_database["city"] == target_city].copy()
-    if "zone" in city_db.columns:
-        hotel_zone_rows = city_db[city_db["name"] == hotel["name"]]["zone"].values
-        hotel_zone = hotel_zone_rows[0] if len(hotel_zone_rows) else None
-        if hotel_zone and hotel_zone not in (None, "isolated"):
-            zone_mask = (city_db["zone"] == hotel_zone) | (city_db["category"] == "Hotel")
-            city_db = city_db[zone_mask]
-
-    # ── Build pools ───────────────────────────────────────────────────────────
-    food_pool = city_db[city_db["category"] == "Food"].to_dict("records")
-
-    full_sight_pool = city_db[
-        (city_db["category"] != "Food") & (city_db["category"] != "Hotel")
-    ].to_dict("records")
-
-    zone_names = set(city_db["name"].tolist())
-    sight_pool = filtered_df[
-        (filtered_df["category"] != "Food")
-        & (filtered_df["category"] != "Hotel")
-        & (filtered_df["name"].isin(zone_names))
-    ].to_dict("records")
-
-    # ── Previously-visited filtering ──────────────────────────────────────────
-    def filter_pool(pool: list[dict]) -> list[dict]:
-        if exclude_visited:
-            fresh = [s for s in pool if s["name"] not in previously_used]
-            return fresh if fresh else pool
-        fresh = [s for s in pool if s["name"] not in previously_used]
-        seen  = [s for s in pool if s["name"] in previously_used]
-        random.shuffle(fresh)
-        random.shuffle(seen)
-        return fresh + seen
-
-    sight_pool      = filter_pool(sight_pool)
-    full_sight_pool = filter_pool(full_sight_pool)
-    food_pool       = filter_pool(food_pool)
-
-    if user_preferences and sight_pool:
-        sight_df = pd.DataFrame(sight_pool)
-        sight_df = score_spots(sight_df, user_preferences)
-        mid    = max(1, len(sight_df) // 2)
-        top    = sight_df.iloc[:mid].to_dict("records")
-        bottom = sight_df.iloc[mid:].to_dict("records")
-        random.shuffle(top)
-        random.shuffle(bottom)
-        sight_pool = top + bottom
+        hotel = Location(-1, -1, "Central Hotel", "Hotel", None,
+                         city_index.center[0], city_index.center[1], 0)
+
+    # ── Static pools (boolean masks over record ids) ──────────────────────────
+    food_ok       = city_index.is_food.copy()
+    full_sight_ok = city_index.is_sight.copy()
+    if candidates is None:
+        sight_ok = full_sight_ok.copy()
     else:
-        random.shuffle(sight_pool)
+        sight_ok = np.zeros(n, dtype=bool)
+        sight_ok[list(candidates)] = True
+        sight_ok &= full_sight_ok
 
-    random.shuffle(food_pool)
+    # Zone filtering
+    if city_index.has_zones:
+        hotel_zone = locs[ids_by_name[hotel.name]].zone if hotel.name in ids_by_name else None
+        if hotel_zone and hotel_zone not in (None, "isolated"):
+            in_zone = (city_index.zones == hotel_zone) | city_index.is_hotel
+            food_ok       &= in_zone
+            full_sight_ok &= in_zone
+            sight_ok      &= in_zone
+
+    # Previously-visited filtering: with exclude_visited, keep only fresh spots
+    # as long as a pool has any
+    if exclude_visited and previously_used:
+        seen = np.zeros(n, dtype=bool)
+        for name in previously_used:
+            nid = ids_by_name.get(name)
+            if nid is not None:
+                seen[city_index.ids_of(nid)] = True
+        for pool in (sight_ok, full_sight_ok, food_ok):
+            fresh = pool & ~seen
+            if fresh.any():
+                pool &= ~seen
 
     # ── State ─────────────────────────────────────────────────────────────────
-    used_sightseeing_names: set = set()
-    used_food_names: set        = set()
-    all_sight_names             = {s["name"] for s in full_sight_pool}
-    slots = ["Breakfast ☕", "Morning 🌅", "Lunch 🍔", "Afternoon ☀️", "Dinner 🍷", "Evening 🌙"]
-    final_itinerary: list[dict] = []
-    recent_sightseeing: list    = []  # rolling window of last 4 picks
+    today      = np.zeros(n, dtype=bool)   # used today
+    used_sight = np.zeros(n, dtype=bool)   # used for sightseeing since last reset
+    used_food  = np.zeros(n, dtype=bool)
+    recent_n   = np.zeros(n, dtype=np.int8)  # occurrences in the recent window
+    recent: deque = deque()                # last RECENT_WINDOW sightseeing nids
+    all_sight_nids = set(city_index.nids[full_sight_ok].tolist())
+    used_sight_nids: set = set()
+
+    aliases = city_index.aliases
+
+    def mark(arr: np.ndarray, nid: int):
+        if nid >= 0:
+            arr[aliases.get(nid, nid)] = True
+
+    def push_recent(nid: int):
+        if len(recent) == RECENT_WINDOW:
+            old = recent.popleft()
+            if old >= 0:
+                recent_n[aliases.get(old, old)] -= 1
+        recent.append(nid)
+        if nid >= 0:
+            recent_n[aliases.get(nid, nid)] += 1
+
+    def use_sight(nid: int):
+        mark(used_sight, nid)
+        used_sight_nids.add(nid)
+        push_recent(nid)
+
+    slots = SLOTS
+    final_itinerary: list[tuple[Location, dict]] = []
 
     # ── Pinned slot resolution ────────────────────────────────────────────────
     pinned_slot: str | None = None
-    if pinned_row:
-        cat = pinned_row.get("category", "")
-        if cat == "Food":
+    if pinned:
+        if pinned.category == "Food":
             pinned_slot = "Lunch 🍔"
         elif rest_mode:
             pinned_slot = "Afternoon ☀️"
         else:
             pinned_slot = "Morning 🌅"
 
+    # ── Day anchors — sights within ~10 km of the hotel ──────────────────────
+    nearby_anchors: list[int] = []
+    if days > 1 and not math.isnan(hotel.lat) and not math.isnan(hotel.lon):
+        nearby_anchors = city_index.grid.within(hotel.lat, hotel.lon, 0.09, full_sight_ok.__getitem__)
+
     # ── Day loop ──────────────────────────────────────────────────────────────
     for d in range(1, days + 1):
         if d == 1:
             current_loc = hotel
         else:
-            nearby_anchors = [
-                s for s in full_sight_pool
-                if _geo_dist(hotel, s) < 0.09  # ~10 km
-            ]
-            current_loc = random.choice(nearby_anchors) if nearby_anchors else hotel
+            current_loc = locs[rng.choice(nearby_anchors)] if nearby_anchors else hotel
 
-        used_today: set = set()
+        today[:] = False
+        is_rainy = d in rainy_days
 
         for slot in slots:
+            extra: dict = {}
 
             # ── Pinned spot injection (Day 1 only) ────────────────────────────
-            if d == 1 and pinned_row and slot == pinned_slot:
-                chosen = pinned_row.copy()
-                chosen["day_num"] = d
-                chosen["slot"]    = slot
-                final_itinerary.append(chosen)
+            if d == 1 and pinned and slot == pinned_slot:
+                chosen = pinned
+                final_itinerary.append((chosen, {"day_num": d, "slot": slot}))
                 current_loc = chosen
-                if pinned_row.get("category") == "Food":
-                    used_food_names.add(chosen["name"])
+                if pinned.category == "Food":
+                    mark(used_food, chosen.nid)
                 else:
-                    used_sightseeing_names.add(chosen["name"])
-                    recent_sightseeing.append(chosen["name"])
-                used_today.add(chosen["name"])
+                    use_sight(chosen.nid)
+                mark(today, chosen.nid)
                 continue
 
             # ── Breakfast — always at hotel ───────────────────────────────────
             if "Breakfast" in slot:
-                chosen = hotel.copy()
+                chosen = hotel
 
             # ── Rest mode — stay at hotel on Day 1 morning ────────────────────
             elif "Morning" in slot and d == 1 and rest_mode:
-                chosen = hotel.copy()
-                chosen["name"] = f"{hotel['name']} (Rest & Settle)"
-                chosen["cost"] = 0
+                chosen = hotel
+                extra  = {"name": f"{hotel.name} (Rest & Settle)", "cost": 0}
 
             # ── Food slots ────────────────────────────────────────────────────
             elif "Lunch" in slot or "Dinner" in slot:
-                pool = [
-                    f for f in food_pool
-                    if f["name"] not in used_food_names and f["name"] not in used_today
-                ]
-                if not pool:
-                    pool = [f for f in food_pool if f["name"] not in used_today]
-                if not pool:
+                pool = food_ok & ~today & ~used_food
+                if not pool.any():
+                    pool = food_ok & ~today
+                if not pool.any():
                     # Full reset — all food spots have been visited; start over
-                    used_food_names.clear()
-                    pool = [f for f in food_pool if f["name"] not in used_today]
-                    random.shuffle(pool)
-
-                chosen = _weighted_pick(pool, current_loc).copy()
-                used_food_names.add(chosen["name"])
-                used_today.add(chosen["name"])
+                    used_food[:] = False
+                chosen = _weighted_pick(pool, current_loc, city_index, rng) if pool.any() else hotel
+                mark(used_food, chosen.nid)
+                mark(today, chosen.nid)
 
             # ── Sightseeing slots (Morning / Afternoon / Evening) ─────────────
             else:
                 # Full reset when all sights have been used
-                if all_sight_names.issubset(used_sightseeing_names):
-                    used_sightseeing_names.clear()
-                    recent_sightseeing.clear()
-
-                is_evening = "Evening" in slot
-
-                def slot_ok(s: dict) -> bool:
-                    """Evening slots exclude outdoor/daytime-only categories."""
-                    if is_evening and s.get("category", "") in ("Nature", "History", "Art"):
-                        return False
-                    return True
-
-                pool = [
-                    s for s in sight_pool
-                    if s["name"] not in used_today
-                    and s["name"] not in recent_sightseeing
-                    and s["name"] not in used_sightseeing_names
-                    and slot_ok(s)
-                ]
-                if not pool:
-                    pool = [
-                        s for s in sight_pool
-                        if s["name"] not in used_today
-                        and s["name"] not in used_sightseeing_names
-                        and slot_ok(s)
-                    ]
-                if not pool:
-                    pool = [
-                        s for s in full_sight_pool
-                        if s["name"] not in used_today
-                        and s["name"] not in recent_sightseeing
-                        and s["name"] not in used_sightseeing_names
-                        and slot_ok(s)
-                    ]
-                if not pool:
-                    pool = [
-                        s for s in full_sight_pool
-                        if s["name"] not in used_today
-                        and s["name"] not in used_sightseeing_names
-                        and slot_ok(s)
-                    ]
-                if not pool:
-                    # Last resort: allow repeats but avoid same-day duplicates
-                    pool = [s for s in full_sight_pool if s["name"] not in used_today]
-                    random.shuffle(pool)
-                if not pool:
-                    pool = [hotel]
-
-                chosen = _weighted_pick(pool, current_loc).copy()
-                used_sightseeing_names.add(chosen["name"])
-                used_today.add(chosen["name"])
-                recent_sightseeing.append(chosen["name"])
-                if len(recent_sightseeing) > 4:
-                    recent_sightseeing.pop(0)
-
-            chosen["day_num"] = d
-            chosen["slot"]    = slot
-            final_itinerary.append(chosen)
+                if all_sight_nids <= used_sight_nids:
+                    used_sight[:] = False
+                    used_sight_nids.clear()
+                    recent.clear()
+                    recent_n[:] = 0
+
+                # Evening slots exclude outdoor/daytime-only categories; rainy
+                # days keep the preferred pool to Indoor spots.
+                slot_ok = city_index.evening_ok if "Evening" in slot else True
+                free    = ~today & ~used_sight & slot_ok
+                fresh   = recent_n == 0
+                dry     = city_index.indoor if is_rainy else True
+
+                for tier in (lambda: sight_ok & free & fresh & dry,
+                             lambda: sight_ok & free & dry,
+                             lambda: full_sight_ok & free & fresh,
+                             lambda: full_sight_ok & free,
+                             # Last resort: allow repeats but avoid same-day duplicates
+                             lambda: full_sight_ok & ~today):
+                    pool = tier()
+                    if pool.any():
+                        chosen = _weighted_pick(pool, current_loc, city_index, rng)
+                        break
+                else:
+                    chosen = hotel
+
+                use_sight(chosen.nid)
+                mark(today, chosen.nid)
+
+            final_itinerary.append((chosen, {**extra, "day_num": d, "slot": slot}))
             current_loc = chosen
 
-    return final_itinerary
+    # Full row dicts only for the finished itinerary
+    return [city_index.spot(loc, **extra) for loc, extra in final_itinerary]
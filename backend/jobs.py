@@ -0,0 +1,259 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+import db
+
+# ── Background generation jobs ────────────────────────────────────────────────
+# POST /trips/generate?async=1 queues the work here instead of holding the
+# request open. Jobs run on their own bounded pool so a burst of generations
+# can't starve the default executor, and submit() refuses new work once
+# JOB_QUEUE_SIZE jobs are waiting on this process.
+#
+# Job state lives in the generation_jobs table (see DOCUMENTATION.md), so a
+# poll can land on any worker or instance, and finished jobs stay readable for
+# JOB_TTL seconds. Each process runs the jobs it accepted and heartbeats them
+# every JOB_LEASE / 4 seconds. When a process dies, its queued jobs are claimed
+# and run by another one once the lease runs out (recover()); jobs it was in
+# the middle of are marked failed rather than re-run, since the trip may
+# already have been saved. Heartbeats are stamped with each process's own
+# clock, so the lease also has to cover any clock skew between instances.
+
+JOB_WORKERS    = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "64"))
+JOB_LEASE      = float(os.environ.get("JOB_LEASE", "120"))
+JOB_HEARTBEAT  = JOB_LEASE / 4
+JOB_TTL        = 900
+
+WORKER_ID   = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+INTERRUPTED = {"status_code": 503, "detail": "Generation was interrupted, please try again."}
+
+
+def _table():
+    return db.get_client().table("generation_jobs")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ("id", "user_id", "kind", "request", "worker", "status", "stage",
+                 "created", "started", "finished", "result", "error")
+
+    def __init__(self, user_id: str, kind: str, request: dict):
+        self.id       = uuid.uuid4().hex
+        self.user_id  = user_id
+        self.kind     = kind       # handler name, see JobQueue.register()
+        self.request  = request    # JSON arguments, enough to run it anywhere
+        self.worker   = WORKER_ID  # process that owns it
+        self.status   = "queued"   # queued → running → done | failed
+        self.stage    = None       # progress label reported by the job itself
+        self.created  = time.time()
+        self.started  = None
+        self.finished = None
+        self.result   = None
+        self.error    = None       # {"status_code": int, "detail": str}
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Job":
+        job = cls.__new__(cls)
+        job.id, job.user_id, job.kind = row["id"], row["user_id"], row["kind"]
+        job.request, job.worker = row.get("request") or {}, row.get("worker")
+        job.status, job.stage = row["status"], row.get("stage")
+        job.created, job.started = row.get("created_at"), row.get("started_at")
+        job.finished = row.get("finished_at")
+        job.result, job.error = row.get("result"), row.get("error")
+        return job
+
+    def to_row(self) -> dict:
+        return {"id": self.id, "user_id": self.user_id, "kind": self.kind,
+                "request": self.request, "worker": self.worker, "status": self.status,
+                "stage": self.stage, "created_at": self.created, "heartbeat_at": self.created}
+
+    def to_dict(self) -> dict:
+        out = {"job_id": self.id, "status": self.status, "stage": self.stage,
+               "created_at": self.created, "started_at": self.started,
+               "finished_at": self.finished}
+        if self.status == "done":
+            out["result"] = self.result
+        elif self.status == "failed":
+            out["error"] = self.error
+        return out
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_QUEUE_SIZE):
+        self.workers     = workers
+        self.max_pending = max_pending
+        self.loop        = None  # the app's event loop, set by start()
+        self._executor   = None
+        self._handlers   = {}
+        self._jobs: dict[str, Job] = {}  # jobs this process owns
+        self._lock       = threading.Lock()
+        self._pending    = 0
+        self._running    = 0
+        self._stats      = {"submitted": 0, "rejected": 0, "recovered": 0, "completed": 0, "failed": 0}
+        self._wait_total = 0.0
+        self._wait_max   = 0.0
+
+    def register(self, kind: str, fn):
+        """fn(request, user_id, progress) → JSON-able result; runs on the job pool."""
+        self._handlers[kind] = fn
+
+    def start(self, loop):
+        """Bind to the app's event loop and open a fresh pool (one per lifespan)."""
+        self.loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gen")
+
+    async def submit(self, user_id: str, kind: str, request: dict) -> Job:
+        """Record and queue a job. Raises QueueFull under backpressure."""
+        with self._lock:
+            self._evict(time.time())
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise QueueFull()
+            job = Job(user_id, kind, request)
+            self._jobs[job.id] = job
+            self._pending += 1
+        try:
+            await db.execute(_table().insert(job.to_row()))
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                del self._jobs[job.id]
+            raise
+        with self._lock:
+            self._stats["submitted"] += 1
+        self._executor.submit(self._run, job)
+        return job
+
+    def _write(self, job: Job, values: dict, status: str | None = None) -> bool:
+        """Update the job's row if this process still owns it. False when
+        another process has taken it over; a failed write is not fatal."""
+        query = _table().update(values).eq("id", job.id).eq("worker", WORKER_ID)
+        if status:
+            query = query.eq("status", status)
+        try:
+            return bool(query.execute().data)
+        except Exception as e:
+            print(f"⚠️  Could not record job {job.id}: {e}")
+            return True
+
+    def _run(self, job: Job):
+        started = time.time()
+        if not self._write(job, {"status": "running", "started_at": started,
+                                 "heartbeat_at": started}, status="queued"):
+            with self._lock:  # recovered elsewhere after we missed our heartbeats
+                self._pending -= 1
+                self._jobs.pop(job.id, None)
+            return
+        job.started = started
+        wait = job.started - job.created
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        job.status = "running"
+
+        def progress(stage: str):
+            job.stage = stage
+            self._write(job, {"stage": stage})
+
+        try:
+            handler = self._handlers[job.kind]
+            job.result = jsonable_encoder(handler(job.request, job.user_id, progress))
+            job.status = "done"
+        except HTTPException as e:
+            job.error, job.status = {"status_code": e.status_code, "detail": e.detail}, "failed"
+        except Exception as e:
+            job.error, job.status = {"status_code": 500, "detail": str(e)}, "failed"
+        finally:
+            job.finished = time.time()
+            self._write(job, {"status": job.status, "result": job.result,
+                              "error": job.error, "finished_at": job.finished})
+            with self._lock:
+                self._running -= 1
+                self._stats["completed" if job.status == "done" else "failed"] += 1
+
+    def _evict(self, now: float):
+        for k in [k for k, j in self._jobs.items() if j.finished and now - j.finished > JOB_TTL]:
+            del self._jobs[k]
+
+    def get(self, job_id: str) -> Job | None:
+        """This process's copy of a job — no database read."""
+        return self._jobs.get(job_id)
+
+    async def lookup(self, job_id: str) -> Job | None:
+        """A job submitted to any process."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        res = await db.execute(_table().select("*").eq("id", job_id).limit(1))
+        return Job.from_row(res.data[0]) if res.data else None
+
+    # ── Leases ── (blocking; run on the DB pool)
+
+    def heartbeat(self):
+        """Renew the lease on every unfinished job this process owns."""
+        with self._lock:
+            ids = [j.id for j in self._jobs.values() if j.status in ("queued", "running")]
+        if ids:
+            _table().update({"heartbeat_at": time.time()}) \
+                .in_("id", ids).eq("worker", WORKER_ID).execute()
+
+    def recover(self):
+        """Take over queued jobs, and fail running ones, whose owner stopped
+        heartbeating; drop rows of jobs finished more than JOB_TTL ago."""
+        now = time.time()
+        stale = _table().select("*").in_("status", ["queued", "running"]) \
+            .lt("heartbeat_at", now - JOB_LEASE).neq("worker", WORKER_ID).execute().data or []
+        for row in stale:
+            if row["status"] == "running":
+                _table().update({"status": "failed", "error": INTERRUPTED, "finished_at": now}) \
+                    .eq("id", row["id"]).eq("worker", row["worker"]).eq("status", "running").execute()
+                continue
+            with self._lock:
+                if row["kind"] not in self._handlers or self._pending >= self.max_pending:
+                    continue
+                self._pending += 1
+            claimed = _table().update({"worker": WORKER_ID, "heartbeat_at": now}) \
+                .eq("id", row["id"]).eq("worker", row["worker"]).eq("status", "queued").execute().data
+            with self._lock:
+                if not claimed:
+                    self._pending -= 1
+                    continue
+                job = Job.from_row(claimed[0])
+                self._jobs[job.id] = job
+                self._stats["recovered"] += 1
+            self._executor.submit(self._run, job)
+        _table().delete().in_("status", ["done", "failed"]).lt("finished_at", now - JOB_TTL).execute()
+
+    def metrics(self) -> dict:
+        """Counters for this process's pool only."""
+        with self._lock:
+            started = self._stats["completed"] + self._stats["failed"] + self._running
+            oldest = min((j.created for j in self._jobs.values() if j.status == "queued"), default=None)
+            return {
+                "worker": WORKER_ID, "workers": self.workers, "max_pending": self.max_pending,
+                "queue_depth": self._pending, "running": self._running,
+                **self._stats,
+                "avg_wait_ms": round(self._wait_total / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 1),
+                "oldest_queued_ms": round((time.time() - oldest) * 1000, 1) if oldest else 0.0,
+            }
+
+    def shutdown(self):
+        # Jobs still queued keep their rows; another process recovers them.
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+queue = JobQueue()
@@ -2,8 +2,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import asyncio
-from routers import trips, locations, profile, memories
+from routers import trips, locations, profile, memories, sync
 import db
+import engine
+import itinerary as itin
+import jobs
 
 
 async def _keepalive_loop():
@@ -11,27 +14,46 @@ async def _keepalive_loop():
     while True:
         await asyncio.sleep(240)  # 4 minutes
         try:
-            db.get_client().table("trips").select("id").limit(1).execute()
+            await db.run(db.ping)
         except Exception:
             pass  # non-fatal — next real request will reconnect
 
 
+async def _job_lease_loop():
+    """Renew the leases on this process's generation jobs and take over the
+    ones left behind by processes that stopped."""
+    while True:
+        try:
+            await db.run(jobs.queue.heartbeat)
+            await db.run(jobs.queue.recover)
+        except Exception as e:
+            print(f"⚠️  Job lease upkeep failed: {e}")
+        await asyncio.sleep(jobs.JOB_HEARTBEAT)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # ── Warm up on startup ────────────────────────────────────────────────────
     # Pre-connect to Supabase and pre-load the locations cache so the first
     # real request doesn't pay the cold-start penalty.
     try:
-        db.get_client()          # establish connection
-        db.get_locations()       # prime the locations cache
+        await db.run(db.get_client)              # establish connection
+        await db.run(db.get_locations)           # prime the locations cache
+        await db.run(locations.warm_payloads)    # pre-serialize GET /locations responses
         print("✅ Supabase connection warmed up, locations cached.")
     except Exception as e:
         print(f"⚠️  Startup warm-up failed (non-fatal): {e}")
+    await itin.load_weather_cache()  # restore forecasts saved by the last run
 
-    # Start keep-alive background task
-    task = asyncio.create_task(_keepalive_loop())
+    # Start keep-alive and job lease background tasks
+    jobs.queue.start(asyncio.get_running_loop())
+    tasks = [asyncio.create_task(_keepalive_loop()), asyncio.create_task(_job_lease_loop())]
     yield
-    task.cancel()
+    for task in tasks:
+        task.cancel()
+    jobs.queue.shutdown()
+    engine.shutdown()
+    await itin.close_weather_client()
 
 
 app = FastAPI(title="Wandr API", version="1.0.0", lifespan=lifespan)
@@ -50,18 +72,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(trips.router,    prefix="/trips",    tags=["trips"])
 app.include_router(locations.router,prefix="/locations", tags=["locations"])
 app.include_router(profile.router,  prefix="/profile",  tags=["profile"])
 app.include_router(memories.router, prefix="/memories", tags=["memories"])
+app.include_router(sync.router,     prefix="/sync",     tags=["sync"])
 
 # Public share endpoint — mounted separately so it has no auth middleware
 from routers.trips import get_shared_trip
 from fastapi import APIRouter as _R
 _share = _R()
 _share.add_api_route("/share/{trip_id}", get_shared_trip, methods=["GET"], tags=["share"])
+app.include_router(_share)
 
 @app.get("/health")
 def health():
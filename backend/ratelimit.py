@@ -0,0 +1,112 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from fastapi import Depends, HTTPException
+import db
+from dependencies import get_current_user_id
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+# Token buckets keyed by (policy, user). The in-memory backend is per process
+# and evicts idle buckets; the Postgres backend keeps buckets in a shared
+# table (take_rate_token function, see DOCUMENTATION.md) so every worker and
+# replica sees the same budget. Pick one with RATE_LIMIT_BACKEND.
+
+
+@dataclass(frozen=True)
+class Policy:
+    capacity: int          # burst size
+    refill_seconds: float  # seconds to earn one token back
+    message: str = "Too many requests. Please wait {wait}s and try again."
+
+
+POLICIES: dict[str, Policy] = {
+    # one generation per user per 15 s, as before
+    "generate":       Policy(1, 15, "Please wait {wait}s before generating another trip."),
+    "regenerate-day": Policy(5, 12, "Please wait {wait}s before re-rolling another day."),
+    "swap":           Policy(20, 3),
+}
+
+
+class MemoryBackend:
+    """Per-process token buckets. Buckets that have refilled completely carry
+    no state worth keeping and are swept once the table grows past max_keys."""
+    local = True
+
+    def __init__(self, max_keys: int = 10_000):
+        self.max_keys = max_keys
+        self._buckets: dict[str, tuple[float, float, float]] = {}  # key → (tokens, updated, full_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, policy: Policy) -> float:
+        """Spend one token. Returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (policy.capacity, now, now))
+            tokens = min(policy.capacity, tokens + (now - updated) / policy.refill_seconds)
+            if tokens >= 1:
+                tokens -= 1
+                retry = 0.0
+            else:
+                retry = (1 - tokens) * policy.refill_seconds
+            full_at = now + (policy.capacity - tokens) * policy.refill_seconds
+            self._buckets[key] = (tokens, now, full_at)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+        return retry
+
+    def _evict(self, now: float):
+        for k in [k for k, (_, _, full_at) in self._buckets.items() if full_at <= now]:
+            del self._buckets[k]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class PostgresBackend:
+    """Buckets in the shared `rate_limits` table. Falls back to a local
+    MemoryBackend if the function isn't installed. Costs one extra database
+    round trip per rate-limited request, so it is only worth it when more
+    than one worker or replica serves the API."""
+    local = False
+
+    def __init__(self):
+        self.fallback = MemoryBackend()
+
+    def take(self, key: str, policy: Policy) -> float:
+        data = db._rpc("take_rate_token", {
+            "p_key": key, "p_capacity": policy.capacity, "p_refill_seconds": policy.refill_seconds,
+        }, scalar=True)
+        if data is None and "take_rate_token" in db._rpc_missing:
+            return self.fallback.take(key, policy)
+        if isinstance(data, bool) or not isinstance(data, (int, float)):
+            # never read a null or malformed answer as "allowed"
+            raise RuntimeError(f"take_rate_token returned {data!r}")
+        return float(data)
+
+    def clear(self):
+        self.fallback.clear()
+
+
+_BACKENDS = {"memory": MemoryBackend, "postgres": PostgresBackend}
+backend = _BACKENDS[os.environ.get("RATE_LIMIT_BACKEND", "memory")]()
+
+
+def rate_limit(name: str):
+    """Dependency that charges one token from `name`'s bucket for the caller
+    and returns their user id; 429 with Retry-After when the bucket is empty."""
+    policy = POLICIES[name]
+
+    async def check(user_id: str = Depends(get_current_user_id)) -> str:
+        key = f"{name}:{user_id}"
+        retry = backend.take(key, policy) if backend.local else await db.run(backend.take, key, policy)
+        if retry > 0:
+            wait = max(1, math.ceil(retry))
+            raise HTTPException(status_code=429, detail=policy.message.format(wait=wait),
+                                headers={"Retry-After": str(wait)})
+        return user_id
+
+    return check
@@ -1,12 +1,119 @@
-from fastapi import APIRouter, Depends
+import gzip
+import hashlib
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 import db
+from cache import TTLCache
 from dependencies import get_current_user_id
 
+try:
+    import brotli  # optional — gzip is always available
+except ImportError:
+    brotli = None
+
 router = APIRouter()
 
-@router.get("")
-def list_locations(user_id: str = Depends(get_current_user_id)):
+# ── Pre-serialized payloads ───────────────────────────────────────────────────
+# Locations never change between restarts, so each (city, fields) view is
+# serialized and compressed once and then served as raw bytes with a content
+# hash ETag. The ETag is weak: the raw, gzip and br bodies are different bytes
+# of the same representation. Clients that send If-None-Match get an empty
+# 304. Full views (one
+# per catalogue city, warmed at startup) are kept apart from `fields`
+# projections, so a stream of projections can't evict them; unknown cities
+# are never cached.
+
+
+class _Payload:
+    __slots__ = ("raw", "gzip", "br", "etag")
+
+    def __init__(self, raw: bytes):
+        self.raw  = raw
+        self.gzip = gzip.compress(raw, compresslevel=9)
+        self.br   = brotli.compress(raw) if brotli else None
+        self.etag = f'W/"{hashlib.sha256(raw).hexdigest()[:32]}"'
+
+
+_views = TTLCache(100_000)      # city (None = everything) → _Payload; bounded by the catalogue
+_projections = TTLCache(256)   # (city, fields) → _Payload
+
+
+def _parse_fields(fields: Optional[str], columns) -> tuple[str, ...] | None:
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(columns)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(c for c in columns if c in wanted)  # keep catalogue column order
+
+
+def _payload(city: Optional[str], fields: tuple[str, ...] | None) -> _Payload:
+    cache, key = (_projections, (city, fields)) if fields else (_views, city)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    df = db.get_city_index(city).df if city else db.get_locations()
+    if fields:
+        df = df[list(fields)]
+    payload = _Payload(df.to_json(orient="records", double_precision=15, force_ascii=False).encode())
+    cache.put(key, payload)
+    return payload
+
+
+def warm_payloads():
+    """Serialize the full catalogue and every per-city view up front."""
     df = db.get_locations()
     if df.empty:
+        return
+    _payload(None, None)
+    for city in df["city"].unique():
+        _payload(city, None)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ is ignored on both sides."""
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def _pick_encoding(header: str, offered: tuple[str, ...]) -> str | None:
+    """The first of `offered` the Accept-Encoding header allows (q > 0)."""
+    q: dict[str, float] = {}
+    for part in header.split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        if not name:
+            continue
+        weight = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    weight = float(param[2:])
+                except ValueError:
+                    weight = 0.0
+        q[name.lower()] = weight
+    return next((enc for enc in offered if q.get(enc, q.get("*", 0.0)) > 0), None)
+
+
+@router.get("")
+def list_locations(request: Request, city: Optional[str] = None, fields: Optional[str] = None,
+                   user_id: str = Depends(get_current_user_id)):
+    df = db.get_locations()
+    if df.empty or (city and db.get_city_index(city).empty):
         return []
-    return df.to_dict("records")
+    payload = _payload(city, _parse_fields(fields, df.columns))
+
+    headers = {"ETag": payload.etag, "Vary": "Accept-Encoding",
+               "Cache-Control": "private, no-cache"}
+    inm = request.headers.get("if-none-match")
+    if inm and etag_matches(inm, payload.etag):
+        return Response(status_code=304, headers=headers)
+
+    offered = ("br", "gzip") if payload.br is not None else ("gzip",)
+    encoding = _pick_encoding(request.headers.get("accept-encoding", ""), offered)
+    if encoding:
+        body, headers["Content-Encoding"] = getattr(payload, encoding), encoding
+    else:
+        body = payload.raw
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
 from typing import Optional
+import asyncio
 import db
 from dependencies import get_current_user_id
 
@@ -21,92 +22,177 @@ class UpdateMemoryRequest(BaseModel):
     image_path: Optional[str] = None
 
 
-def _verify_trip_owner(trip_id: str, user_id: str):
-    """Make sure the trip belongs to this user before touching its memories."""
+async def _verify_trip_owner(trip_id: str, user_id: str):
+    """Make sure the trip belongs to this user before touching its memories.
+    Answered from the trip-owner cache when possible."""
+    owner = db.cached_trip_owner(trip_id)
+    if owner is None:
+        owner = await db.run(db.trip_owner, trip_id)
+    if owner != user_id:
+        raise HTTPException(status_code=403, detail="Trip not found or access denied.")
+
+
+async def _load_memory(memory_id: str, user_id: str, columns: str) -> dict:
+    """Fetch a memory together with its trip's owner in one query."""
     client = db.get_client()
-    res = client.table("trips").select("id").eq("id", trip_id).eq("user_id", user_id).execute()
+    res = await db.execute(client.table("memories").select(f"{columns}, trips(user_id)").eq("id", memory_id))
     if not res.data:
+        raise HTTPException(status_code=404, detail="Memory not found.")
+    mem = res.data[0]
+    owner = (mem.pop("trips", None) or {}).get("user_id")
+    if owner != user_id:
         raise HTTPException(status_code=403, detail="Trip not found or access denied.")
+    db.remember_owners([mem["trip_id"]], owner)
+    return mem
+
+
+def _owns_image(path: str, user_id: str) -> bool:
+    """Uploads live under `<user_id>/` in the memories bucket."""
+    return path.startswith(f"{user_id}/") and ".." not in path.split("/")
+
+
+def _check_image_path(path: str | None, user_id: str):
+    if path and not _owns_image(path, user_id):
+        raise HTTPException(status_code=400, detail="image_path must point to one of your own uploads.")
+
+
+async def _sign_images(memories: list[dict], owner_id: str) -> list[dict]:
+    """Point image_url at a fresh signed URL for every memory with a stored
+    image under the trip owner's folder; anything else is never signed.
+    If Storage can't sign them the stored image_url is left in place."""
+    paths = [m["image_path"] for m in memories
+             if m.get("image_path") and _owns_image(m["image_path"], owner_id)]
+    if paths:
+        try:
+            urls = await db.run(db.signed_urls, paths)
+        except Exception:
+            return memories  # a Storage outage must not take the memories down with it
+        for m in memories:
+            if m.get("image_path") in urls:
+                m["image_url"] = urls[m["image_path"]]
+    return memories
+
+
+# Declared before /{trip_id}/{day_num}, which would otherwise capture it
+@router.get("/{trip_id}/days")
+async def get_trip_memories(trip_id: str, response: Response,
+                            limit: int = Query(50, ge=1, le=200),
+                            cursor: Optional[str] = None,
+                            user_id: str = Depends(get_current_user_id)):
+    """A trip's memories grouped by day, one ownership check for the whole
+    trip. Pages hold up to `limit` memories in (day_num, created_at) order;
+    pass the X-Next-Cursor response header back as `cursor` for the next one.
+    A day can continue on the following page."""
+    client = db.get_client()
+    query = client.table("memories").select("*").eq("trip_id", trip_id)
+    if cursor:
+        try:
+            day_num, created_at, memory_id = db.decode_cursor(cursor, (int, str, str))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        query = query.or_(f'day_num.gt.{day_num},'
+                          f'and(day_num.eq.{day_num},created_at.gt."{created_at}"),'
+                          f'and(day_num.eq.{day_num},created_at.eq."{created_at}",id.gt."{memory_id}")')
+    query = query.order("day_num").order("created_at").order("id").limit(limit + 1)
+
+    _, res = await asyncio.gather(_verify_trip_owner(trip_id, user_id), db.execute(query))
+    rows = res.data or []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = db.encode_cursor(last["day_num"], last["created_at"], last["id"])
+
+    days: dict[int, list] = {}
+    for m in await _sign_images(rows, user_id):
+        days.setdefault(m["day_num"], []).append(m)
+    return [{"day_num": d, "memories": mems} for d, mems in days.items()]
 
 
 @router.get("/{trip_id}/{day_num}")
-def get_memories(trip_id: str, day_num: int, user_id: str = Depends(get_current_user_id)):
-    _verify_trip_owner(trip_id, user_id)
+async def get_memories(trip_id: str, day_num: int, user_id: str = Depends(get_current_user_id)):
     client = db.get_client()
-    res = (
-        client.table("memories")
-        .select("*")
-        .eq("trip_id", trip_id)
-        .eq("day_num", day_num)
-        .order("created_at")
-        .execute()
+    # Ownership check and the read are independent — run them together
+    _, res = await asyncio.gather(
+        _verify_trip_owner(trip_id, user_id),
+        db.execute(
+            client.table("memories")
+            .select("*")
+            .eq("trip_id", trip_id)
+            .eq("day_num", day_num)
+            .order("created_at")
+        ),
     )
     return res.data or []
 
 
 @router.get("/{trip_id}")
-def get_all_memories(trip_id: str, user_id: str = Depends(get_current_user_id)):
-    _verify_trip_owner(trip_id, user_id)
+async def get_all_memories(trip_id: str, user_id: str = Depends(get_current_user_id)):
     client = db.get_client()
-    res = (
-        client.table("memories")
-        .select("*")
-        .eq("trip_id", trip_id)
-        .order("day_num")
-        .execute()
+    _, res = await asyncio.gather(
+        _verify_trip_owner(trip_id, user_id),
+        db.execute(
+            client.table("memories")
+            .select("*")
+            .eq("trip_id", trip_id)
+            .order("day_num")
+        ),
     )
     return res.data or []
 
 
 @router.post("")
-def save_memory(body: SaveMemoryRequest, user_id: str = Depends(get_current_user_id)):
-    _verify_trip_owner(body.trip_id, user_id)
+async def save_memory(body: SaveMemoryRequest, user_id: str = Depends(get_current_user_id)):
+    _check_image_path(body.image_path, user_id)
+    await _verify_trip_owner(body.trip_id, user_id)
     client = db.get_client()
-    res = client.table("memories").insert({
+    res = await db.execute(client.table("memories").insert({
         "trip_id":    body.trip_id,
         "day_num":    body.day_num,
         "note":       body.note or '',
         "image_url":  body.image_url or '',
         "image_path": body.image_path or '',
-    }).execute()
+    }))
     return res.data[0] if res.data else {}
 
 
 @router.patch("/{memory_id}")
-def update_memory(
+async def update_memory(
     memory_id: str,
     body: UpdateMemoryRequest,
     user_id: str = Depends(get_current_user_id)
 ):
+    _check_image_path(body.image_path, user_id)
     client = db.get_client()
-    # Verify ownership via trip
-    mem = client.table("memories").select("trip_id").eq("id", memory_id).execute()
-    if not mem.data:
-        raise HTTPException(status_code=404, detail="Memory not found.")
-    _verify_trip_owner(mem.data[0]["trip_id"], user_id)
+    await _load_memory(memory_id, user_id, "trip_id")
 
     updates = {k: v for k, v in body.dict().items() if v is not None}
     if not updates:
         raise HTTPException(status_code=400, detail="Nothing to update.")
-    res = client.table("memories").update(updates).eq("id", memory_id).execute()
+    res = await db.execute(client.table("memories").update(updates).eq("id", memory_id))
     return res.data[0] if res.data else {}
 
 
 @router.delete("/{memory_id}")
-def delete_memory(memory_id: str, user_id: str = Depends(get_current_user_id)):
+async def delete_memory(memory_id: str, user_id: str = Depends(get_current_user_id)):
     client = db.get_client()
-    mem = client.table("memories").select("trip_id, image_path").eq("id", memory_id).execute()
-    if not mem.data:
-        raise HTTPException(status_code=404, detail="Memory not found.")
-    _verify_trip_owner(mem.data[0]["trip_id"], user_id)
+    mem = await _load_memory(memory_id, user_id, "trip_id, image_path")
 
-    # If there's a stored image, remove it from Storage too
-    image_path = mem.data[0].get("image_path", "")
+    # If there's a stored image of this user's, remove it from Storage too
+    image_path = mem.get("image_path", "")
+    if not _owns_image(image_path, user_id):
+        image_path = ""
     if image_path:
-        try:
-            client.storage.from_("memories").remove([image_path])
-        except Exception:
-            pass  # Don't block deletion if storage removal fails
-
-    client.table("memories").delete().eq("id", memory_id).execute()
+        db.forget_signed_url(image_path)
+
+    async def remove_image():
+        if image_path:
+            try:
+                await db.run(client.storage.from_("memories").remove, [image_path])
+            except Exception:
+                pass  # Don't block deletion if storage removal fails
+
+    await asyncio.gather(
+        remove_image(),
+        db.execute(client.table("memories").delete().eq("id", memory_id)),
+    )
     return {"deleted": memory_id}
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
+import asyncio
 import db
 from dependencies import get_current_user_id
 
@@ -14,18 +15,18 @@ class UpdateProfileRequest(BaseModel):
 
 
 @router.get("")
-def get_profile(user_id: str = Depends(get_current_user_id)):
+async def get_profile(user_id: str = Depends(get_current_user_id)):
     client = db.get_client()
-    res = client.table("profiles").select("*").eq("id", user_id).execute()
+    res = await db.execute(client.table("profiles").select("*").eq("id", user_id))
     if res.data:
         return res.data[0]
     # Auto-create if missing (for existing users)
-    client.table("profiles").insert({"id": user_id}).execute()
+    await db.execute(client.table("profiles").insert({"id": user_id}))
     return {"id": user_id, "name": "", "preferences": []}
 
 
 @router.patch("")
-def update_profile(body: UpdateProfileRequest, user_id: str = Depends(get_current_user_id)):
+async def update_profile(body: UpdateProfileRequest, user_id: str = Depends(get_current_user_id)):
     client = db.get_client()
     updates = {}
     if body.name is not None:
@@ -35,20 +36,24 @@ def update_profile(body: UpdateProfileRequest, user_id: str = Depends(get_curren
         updates["preferences"] = valid
     if not updates:
         raise HTTPException(status_code=400, detail="Nothing to update.")
-    res = client.table("profiles").update(updates).eq("id", user_id).execute()
+    res = await db.execute(client.table("profiles").update(updates).eq("id", user_id))
     return res.data[0] if res.data else {}
 
 
 @router.delete("")
-def delete_account(user_id: str = Depends(get_current_user_id)):
+async def delete_account(user_id: str = Depends(get_current_user_id)):
     client = db.get_client()
-    # Delete all trips + spots (cascade handles spots)
-    client.table("trips").delete().eq("user_id", user_id).execute()
-    # Delete profile row
-    client.table("profiles").delete().eq("id", user_id).execute()
+    # Delete all trips + spots (cascade handles spots) and the profile row
+    trips_res, _ = await asyncio.gather(
+        db.execute(client.table("trips").delete().eq("user_id", user_id)),
+        db.execute(client.table("profiles").delete().eq("id", user_id)),
+    )
+    db.forget_visited(user_id)
+    db.forget_owners(user_id=user_id)
+    db.forget_shares(t["id"] for t in trips_res.data or [])
     # Delete the actual auth user — requires service role key
     try:
-        client.auth.admin.delete_user(user_id)
+        await db.run(client.auth.admin.delete_user, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not delete auth user: {e}")
     return {"deleted": user_id}
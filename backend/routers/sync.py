@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+import db
+from dependencies import get_current_user_id
+
+router = APIRouter()
+
+
+# ── Delta sync ────────────────────────────────────────────────────────────────
+# Clients keep the `watermark` from each response and pass it back as `since`.
+# Without one, or with one older than tombstones are kept, the response holds
+# everything and `reset` is true: replace local state instead of merging.
+
+@router.get("")
+async def sync(since: Optional[str] = None, user_id: str = Depends(get_current_user_id)):
+    after = None
+    if since:
+        try:
+            # fromisoformat only accepts a "Z" suffix from Python 3.11 on
+            after = datetime.fromisoformat(since[:-1] + "+00:00" if since.endswith(("Z", "z")) else since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="`since` must be an ISO 8601 timestamp.")
+        if after.tzinfo is None:
+            after = after.replace(tzinfo=timezone.utc)
+        if after < datetime.now(timezone.utc) - timedelta(days=db.TOMBSTONE_DAYS):
+            after = None  # deletes that old are gone; start over
+    return await db.get_changes(user_id, after)
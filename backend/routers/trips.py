@@ -1,23 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from datetime import date
 from typing import Optional
 import asyncio
-import time
-import pandas as pd
+import os
 
 import db
+import engine
 import itinerary as itin
-from dependencies import get_current_user_id
+import jobs
+from dependencies import get_current_user_id, require_admin
+from ratelimit import rate_limit
+from routers.locations import etag_matches
 
 router = APIRouter()
 
-# ── Simple in-memory rate limiter for trip generation ─────────────────────────
-# Stores { user_id: last_generate_timestamp }
-_gen_timestamps: dict[str, float] = {}
-GEN_COOLDOWN_SECONDS = 15  # minimum seconds between generations per user
-
-
 # ── Schemas ───────────────────────────────────────────────────────────────────
 
 class GenerateTripRequest(BaseModel):
@@ -32,6 +29,7 @@ class GenerateTripRequest(BaseModel):
     rest_on_arrival: bool = True
     exclude_visited: bool = False
     pinned_spot: Optional[str] = None  # spot name to guarantee in the itinerary
+    seed: Optional[int] = None         # same seed + same inputs → same itinerary
 
 class UpdateStatusRequest(BaseModel):
     status: str
@@ -46,93 +44,122 @@ class SwapSpotRequest(BaseModel):
 
 class RegenerateDayRequest(BaseModel):
     day_num: int
+    seed: Optional[int] = None
 
 
-# ── Helpers ───────────────────────────────────────────────────────────────────
+# ── Auth-required routes ──────────────────────────────────────────────────────
 
-def _verify_owner(trip_id: str, user_id: str):
-    client = db.get_client()
-    res = client.table("trips").select("id").eq("id", trip_id).eq("user_id", user_id).execute()
-    if not res.data:
-        raise HTTPException(status_code=403, detail="Trip not found or access denied.")
+def _parse_trip_fields(fields: Optional[str], summary: bool) -> tuple[str, ...] | None:
+    if not fields:
+        return db.SUMMARY_FIELDS if summary else None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(db.TRIP_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(f for f in db.TRIP_FIELDS if f in wanted | {"id"})
 
 
-# ── Auth-required routes ──────────────────────────────────────────────────────
-
 @router.get("")
-def list_trips(user_id: str = Depends(get_current_user_id)):
-    return db.get_trips(user_id)
+async def list_trips(response: Response,
+                     limit: Optional[int] = Query(None, ge=1, le=100),
+                     cursor: Optional[str] = None,
+                     summary: bool = False,
+                     fields: Optional[str] = None,
+                     user_id: str = Depends(get_current_user_id)):
+    """Trips newest first. With `limit`, one page at a time: pass the
+    X-Next-Cursor response header back as `cursor` for the next page.
+    `summary` (or `fields` without "spots") skips loading spots."""
+    wanted = _parse_trip_fields(fields, summary)
+    try:
+        after = db.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    trips, next_cursor = await db.run(db.get_trips, user_id, limit, after, wanted)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return trips
 
 
 @router.post("/generate")
-async def generate_trip(body: GenerateTripRequest, user_id: str = Depends(get_current_user_id)):
-    # ── Rate limit: one generation per user per GEN_COOLDOWN_SECONDS ──────────
-    now = time.time()
-    last = _gen_timestamps.get(user_id, 0)
-    if now - last < GEN_COOLDOWN_SECONDS:
-        wait = int(GEN_COOLDOWN_SECONDS - (now - last))
-        raise HTTPException(status_code=429, detail=f"Please wait {wait}s before generating another trip.")
-    _gen_timestamps[user_id] = now
-
-    df = db.get_locations()
-    if df.empty:
+async def generate_trip(body: GenerateTripRequest, response: Response,
+                        async_: bool = Query(False, alias="async"),
+                        user_id: str = Depends(rate_limit("generate"))):
+    # Catalogue reads go through the DB pool: a cold cache means a Supabase fetch
+    if (await db.run(db.get_locations)).empty:
         raise HTTPException(status_code=500, detail="Location database is empty.")
 
+    # ── Job mode: queue it and return straight away; poll /trips/jobs/{id} ────
+    if async_:
+        try:
+            job = await jobs.queue.submit(user_id, "generate", body.model_dump(mode="json"))
+        except jobs.QueueFull:
+            raise HTTPException(status_code=503, detail="Trip generation is busy, try again shortly.",
+                                headers={"Retry-After": "5"})
+        response.status_code = 202
+        response.headers["Location"] = f"/trips/jobs/{job.id}"
+        return job.to_dict()
+
+    # One forecast call per city, shared with concurrent requests
+    city, weather = await asyncio.gather(db.run(db.get_city_index, body.city),
+                                         itin.get_weather(body.city))
+
     # ── Run blocking work in a thread pool so we don't block the event loop ───
     loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(None, _do_generate, body, user_id, df)
+    result = await loop.run_in_executor(None, _do_generate, body, user_id, city, weather)
     return result
 
 
-def _do_generate(body: GenerateTripRequest, user_id: str, df) -> dict:
+def _generate_job(request: dict, user_id: str, progress) -> dict:
+    """Job-mode entry point — runs on the jobs pool of whichever process picks
+    the job up. The weather client belongs to the event loop, so the forecast
+    is fetched there."""
+    body = GenerateTripRequest(**request)
+    city = db.get_city_index(body.city)
+    progress("weather")
+    weather = asyncio.run_coroutine_threadsafe(itin.get_weather(body.city), jobs.queue.loop).result()
+    return _do_generate(body, user_id, city, weather, progress)
+
+
+jobs.queue.register("generate", _generate_job)
+
+
+def _do_generate(body: GenerateTripRequest, user_id: str, city, weather, progress=None) -> dict:
     """Synchronous trip generation — runs in a thread pool."""
     import datetime as dt
+    progress = progress or (lambda stage: None)
 
-    cond, temp = itin.get_weather_status(body.city)
-    forecast   = itin.get_forecast(body.city)
-
-    filtered = df[df["city"] == body.city].copy()
-    if body.user_preferences:
-        filtered = filtered[filtered["category"].isin(body.user_preferences + ["Hotel"])]
-    if cond in ["Rain", "Drizzle", "Thunderstorm"] and not body.allow_outdoor_rain:
-        filtered = filtered[filtered["type"] == "Indoor"]
+    cond, temp = weather.current
+    rainy_days = set() if body.allow_outdoor_rain else weather.rainy_days(body.start_date, body.days)
 
+    max_activity_cost = None
     if body.max_budget and body.max_budget > 0:
         if body.chosen_hotel:
-            rows = df[df["name"] == body.chosen_hotel]["cost"].values
-            hotel_nightly = rows[0] if len(rows) > 0 else 0
+            row = city.by_name.get(body.chosen_hotel)
+            hotel_nightly = row["cost"] if row else 0
         else:
-            pool = df[(df["city"] == body.city) & (df["category"] == "Hotel")]
-            hotel_nightly = pool["cost"].min() if not pool.empty else 0
+            cheapest = city.cheapest_hotel()
+            hotel_nightly = cheapest["cost"] if cheapest else 0
 
         activity_budget = body.max_budget - hotel_nightly * body.days - 40 * body.days
         if activity_budget < 0:
-            cheapest = df[(df["city"] == body.city) & (df["category"] == "Hotel")].nsmallest(1, "cost")
-            if not cheapest.empty:
+            cheapest = city.cheapest_hotel()
+            if cheapest:
                 raise HTTPException(status_code=400,
                     detail=f"Budget of ${body.max_budget} doesn't cover the hotel alone. "
-                           f"Consider '{cheapest.iloc[0]['name']}' at ${int(cheapest.iloc[0]['cost'])}/night.")
-        non_hotel_mask = filtered["category"] != "Hotel"
-        filtered_activities = filtered[non_hotel_mask].sort_values("cost")
-        filtered_activities = filtered_activities[
-            filtered_activities["cost"] <= max(activity_budget / max(body.days, 1), 0)
-        ]
-        filtered = pd.concat([filtered[~non_hotel_mask], filtered_activities])
-
-    all_trips = db.get_trips(user_id)
-    previously_used = set()
-    for t in all_trips:
-        if t["city"] == body.city:
-            for spot in t["spots"]:
-                previously_used.add(spot["name"])
-
-    spots = itin.organize_itinerary(
-        filtered_df=filtered, days=body.days, target_city=body.city,
-        full_database=df, rest_mode=body.rest_on_arrival,
-        previously_used=previously_used, exclude_visited=body.exclude_visited,
-        chosen_hotel=body.chosen_hotel, user_preferences=body.user_preferences or [],
-        pinned_spot=body.pinned_spot,
-    )
+                           f"Consider '{cheapest['name']}' at ${int(cheapest['cost'])}/night.")
+        max_activity_cost = max(activity_budget / max(body.days, 1), 0)
+
+    progress("history")
+    previously_used = db.get_visited_names(user_id, body.city)
+
+    progress("generating")
+    spots = engine.generate(engine.PlanParams(
+        city=body.city, days=body.days, rest_mode=body.rest_on_arrival,
+        previously_used=frozenset(previously_used), exclude_visited=body.exclude_visited,
+        chosen_hotel=body.chosen_hotel, user_preferences=tuple(body.user_preferences or ()),
+        pinned_spot=body.pinned_spot, rainy_days=frozenset(rainy_days),
+        max_activity_cost=max_activity_cost, seed=body.seed,
+    ))
 
     cost     = itin.predict_total_budget(body.days, spots)
     end_date = (body.start_date + dt.timedelta(days=body.days - 1)) if body.start_date else None
@@ -142,56 +169,89 @@ def _do_generate(body: GenerateTripRequest, user_id: str, df) -> dict:
         "title": body.title.strip() or f"Trip to {body.city}",
         "city": body.city, "days": body.days, "cost": cost, "status": status,
         "start_date": body.start_date, "end_date": end_date,
-        "weather": {"condition": cond, "temp": temp}, "forecast": forecast, "spots": spots,
+        "weather": {"condition": cond, "temp": temp}, "forecast": weather.daily, "spots": spots,
         "max_budget": body.max_budget if body.max_budget and body.max_budget > 0 else None,
     }
-    trip_id    = db.save_trip(user_id, trip)
-    trip["id"] = trip_id
+    progress("saving")
+    saved         = db.save_trip(user_id, trip)
+    trip["id"]    = saved["id"]
+    trip["spots"] = saved["spots"]  # stored rows, with their spot ids
 
     over_budget = body.max_budget and body.max_budget > 0 and cost > body.max_budget
     return {**trip, "over_budget": bool(over_budget),
             "over_by": round(cost - body.max_budget, 2) if over_budget else 0.0}
 
 
+# ── Generation jobs ───────────────────────────────────────────────────────────
+
+@router.get("/jobs/metrics")
+async def job_metrics(user_id: str = Depends(require_admin)):
+    """Queue depth, throughput and wait times of this process's generation pool."""
+    return jobs.queue.metrics()
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(get_current_user_id)):
+    job = await jobs.queue.lookup(job_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
+
+
 @router.get("/{trip_id}")
-def get_trip(trip_id: str, user_id: str = Depends(get_current_user_id)):
-    all_trips = db.get_trips(user_id)
-    trip = next((t for t in all_trips if t["id"] == trip_id), None)
+async def get_trip(trip_id: str, user_id: str = Depends(get_current_user_id)):
+    trip = await db.run(db.get_trip, trip_id, user_id)
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found.")
     return trip
 
 
+@router.get("/{trip_id}/spots")
+async def get_trip_spots(trip_id: str, user_id: str = Depends(get_current_user_id)):
+    """Full spot list of one trip, for clients that listed trips in summary mode."""
+    spots = await db.run(db.get_trip_spots, trip_id, user_id)
+    if spots is None:
+        raise HTTPException(status_code=404, detail="Trip not found.")
+    return spots
+
+
 @router.delete("/{trip_id}")
-def delete_trip(trip_id: str, user_id: str = Depends(get_current_user_id)):
-    _verify_owner(trip_id, user_id)
-    db.delete_trip(trip_id)
+async def delete_trip(trip_id: str, user_id: str = Depends(get_current_user_id)):
+    # Owner-scoped writes double as the access check
+    if not await db.run(db.delete_trip, trip_id, user_id):
+        raise HTTPException(status_code=403, detail="Trip not found or access denied.")
     return {"deleted": trip_id}
 
 
 @router.patch("/{trip_id}/status")
-def update_status(trip_id: str, body: UpdateStatusRequest,
-                  user_id: str = Depends(get_current_user_id)):
-    _verify_owner(trip_id, user_id)
-    db.update_trip_status(trip_id, body.status)
+async def update_status(trip_id: str, body: UpdateStatusRequest,
+                        user_id: str = Depends(get_current_user_id)):
+    if not await db.run(db.update_trip_status, trip_id, body.status, user_id):
+        raise HTTPException(status_code=403, detail="Trip not found or access denied.")
     return {"trip_id": trip_id, "status": body.status}
 
 
 # ── Spot swap ─────────────────────────────────────────────────────────────────
 
 @router.patch("/{trip_id}/spots/{spot_id}")
-def swap_spot(trip_id: str, spot_id: str, body: SwapSpotRequest,
-              user_id: str = Depends(get_current_user_id)):
+async def swap_spot(trip_id: str, spot_id: str, body: SwapSpotRequest,
+                    user_id: str = Depends(rate_limit("swap"))):
     """Replace a single spot with a different location."""
-    _verify_owner(trip_id, user_id)
     client = db.get_client()
 
-    spot_res = client.table("trip_spots").select("*").eq("id", spot_id).execute()
-    if not spot_res.data:
+    # One round of reads: the owner-scoped trip row doubles as the ownership
+    # check, and the trip's spots give both the target spot and the cost basis.
+    trip_res, spots_res = await asyncio.gather(
+        db.execute(client.table("trips").select("days, city").eq("id", trip_id).eq("user_id", user_id)),
+        db.execute(client.table("trip_spots").select("*").eq("trip_id", trip_id)),
+    )
+    if not trip_res.data:
+        raise HTTPException(status_code=403, detail="Trip not found or access denied.")
+    trip = trip_res.data[0]
+    all_spots = spots_res.data or []
+    spot = next((s for s in all_spots if s["id"] == spot_id), None)
+    if spot is None:
         raise HTTPException(status_code=404, detail="Spot not found.")
-    spot = spot_res.data[0]
-    if spot["trip_id"] != trip_id:
-        raise HTTPException(status_code=403, detail="Spot does not belong to this trip.")
 
     updates = {
         "name":     body.new_name,
@@ -201,132 +261,88 @@ def swap_spot(trip_id: str, spot_id: str, body: SwapSpotRequest,
         "lon":      body.new_lon,
         "cost":     body.new_cost,
     }
-    res = client.table("trip_spots").update(updates).eq("id", spot_id).execute()
+    # Recalculate trip total cost with the swap applied
+    swapped = [{**s, **updates} if s["id"] == spot_id else s for s in all_spots]
+    new_cost = itin.predict_total_budget(trip["days"], swapped)
 
-    # Recalculate trip total cost
-    trip_res = client.table("trips").select("days").eq("id", trip_id).execute()
-    all_spots_res = client.table("trip_spots").select("*").eq("trip_id", trip_id).execute()
-    all_spots = all_spots_res.data or []
-    if trip_res.data and all_spots:
-        new_cost = itin.predict_total_budget(trip_res.data[0]["days"], all_spots)
-        client.table("trips").update({"cost": new_cost}).eq("id", trip_id).execute()
+    # One round of writes: spot + cost together
+    updated = await db.run(db.swap_spot, trip_id, spot_id, updates, new_cost)
+    db.update_visited(user_id, trip["city"], added=[body.new_name], removed=[spot["name"]])
 
-    return res.data[0] if res.data else {}
+    return updated
 
 
 # ── Regenerate a single day ───────────────────────────────────────────────────
 
 @router.post("/{trip_id}/regenerate-day")
-def regenerate_day(trip_id: str, body: RegenerateDayRequest,
-                   user_id: str = Depends(get_current_user_id)):
+async def regenerate_day(trip_id: str, body: RegenerateDayRequest,
+                         user_id: str = Depends(rate_limit("regenerate-day"))):
     """Delete and re-generate spots for one day."""
-    _verify_owner(trip_id, user_id)
     client = db.get_client()
 
-    trip_res = client.table("trips").select("*").eq("id", trip_id).execute()
+    # Owner-scoped trip row (doubles as the ownership check) and every spot of
+    # the trip, fetched together and split by day in Python.
+    trip_res, spots_res = await asyncio.gather(
+        db.execute(client.table("trips").select("*").eq("id", trip_id).eq("user_id", user_id)),
+        db.execute(client.table("trip_spots").select("*").eq("trip_id", trip_id)),
+    )
     if not trip_res.data:
-        raise HTTPException(status_code=404, detail="Trip not found.")
+        raise HTTPException(status_code=403, detail="Trip not found or access denied.")
     trip = trip_res.data[0]
 
+    all_spots   = spots_res.data or []
     # Spots on OTHER days — preserve these and use as exclusion set
-    other_res = client.table("trip_spots").select("*") \
-        .eq("trip_id", trip_id).neq("day_num", body.day_num).execute()
-    other_spots = other_res.data or []
-    # Exclude spots already used on OTHER days so reroll gives genuinely new spots
-    previously_used = {s["name"] for s in other_spots if s["category"] != "Hotel"}
-
-    # Also get the spots being replaced so we can exclude them too
-    current_day_res = client.table("trip_spots").select("name") \
-        .eq("trip_id", trip_id).eq("day_num", body.day_num).execute()
-    current_day_names = {s["name"] for s in (current_day_res.data or []) if s.get("category") != "Hotel"}
-    previously_used.update(current_day_names)
-
-    # Delete only this day
-    client.table("trip_spots").delete() \
-        .eq("trip_id", trip_id).eq("day_num", body.day_num).execute()
-
-    df = db.get_locations()
-    if df.empty:
+    other_spots = [s for s in all_spots if s["day_num"] != body.day_num]
+    current_day = [s for s in all_spots if s["day_num"] == body.day_num]
+    # Exclude spots already used on other days, and the ones being replaced,
+    # so the reroll gives genuinely new spots
+    previously_used = {s["name"] for s in all_spots if s["category"] != "Hotel"}
+
+    if (await db.run(db.get_locations)).empty:
         raise HTTPException(status_code=500, detail="Location database is empty.")
 
     city = trip["city"]
-    filtered = df[df["city"] == city].copy()
 
     # Reuse the same hotel as the rest of the trip
     hotel_spot = next((s for s in other_spots if s["category"] == "Hotel"), None)
     chosen_hotel = hotel_spot["name"] if hotel_spot else None
 
-    # Use hotel location as the proximity anchor for the rerolled day
-    hotel_row = df[(df["city"] == city) & (df["name"] == chosen_hotel)] if chosen_hotel else None
-    hotel_lat = float(hotel_row.iloc[0]["lat"]) if hotel_row is not None and not hotel_row.empty else None
-    hotel_lon = float(hotel_row.iloc[0]["lon"]) if hotel_row is not None and not hotel_row.empty else None
-
-    new_spots = itin.organize_itinerary(
-        filtered_df=filtered, days=1, target_city=city,
-        full_database=df, rest_mode=False,
-        previously_used=previously_used, exclude_visited=True,
-        chosen_hotel=chosen_hotel, user_preferences=[],
-    )
+    loop = asyncio.get_event_loop()
+    new_spots = await loop.run_in_executor(None, engine.generate, engine.PlanParams(
+        city=city, days=1, rest_mode=False,
+        previously_used=frozenset(previously_used), exclude_visited=True,
+        chosen_hotel=chosen_hotel, seed=body.seed,
+    ))
 
     # Stamp with the correct day number
     for s in new_spots:
         s["day_num"] = body.day_num
+    rows = [db.spot_row(trip_id, s, city) for s in new_spots]
 
-    rows = [{
-        "trip_id":  trip_id,
-        "name":     s["name"],
-        "city":     s.get("city", city),
-        "category": s["category"],
-        "type":     s.get("type", ""),
-        "lat":      float(s["lat"]),
-        "lon":      float(s["lon"]),
-        "cost":     float(s["cost"]),
-        "day_num":  int(s["day_num"]),
-        "slot":     str(s["slot"]),
-    } for s in new_spots]
-
-    new_spots_with_ids = []
-    if rows:
-        inserted = client.table("trip_spots").insert(rows).execute()
-        new_spots_with_ids = inserted.data or []
-
-    # Recalculate total cost
-    all_spots = other_spots + new_spots_with_ids
-    new_cost = itin.predict_total_budget(trip["days"], all_spots)
-    client.table("trips").update({"cost": new_cost}).eq("id", trip_id).execute()
+    # Recalculate total cost, then delete + insert + cost update in one call
+    new_cost = itin.predict_total_budget(trip["days"], other_spots + rows)
+    new_spots_with_ids = await db.run(db.replace_day_spots, trip_id, body.day_num, rows, new_cost)
+    db.update_visited(user_id, city, added=[s["name"] for s in rows],
+                      removed=[s["name"] for s in current_day])
 
     return {"day_num": body.day_num, "new_spots": new_spots_with_ids, "new_cost": new_cost}
 
 
 # ── Public share (no auth required) ──────────────────────────────────────────
+# Served from db's share snapshots: pre-serialized bytes with an ETag, so a
+# repeat view is a dict lookup and a revalidation is an empty 304.
+SHARE_MAX_AGE = int(os.environ.get("SHARE_MAX_AGE", "60"))
+
 
 @router.get("/share/{trip_id}")
-def get_shared_trip(trip_id: str):
+async def get_shared_trip(trip_id: str, request: Request):
     """Read-only public endpoint — no authentication required."""
-    client = db.get_client()
-
-    trip_res = client.table("trips").select("*").eq("id", trip_id).execute()
-    if not trip_res.data:
+    snap = db.cached_share(trip_id) or await db.run(db.share_snapshot, trip_id)
+    if snap is None:
         raise HTTPException(status_code=404, detail="Trip not found.")
-    t = trip_res.data[0]
-
-    spots_res = client.table("trip_spots").select("*") \
-        .eq("trip_id", trip_id).order("day_num").execute()
-
-    slot_order = ["Breakfast ☕","Morning 🌅","Lunch 🍔","Afternoon ☀️","Dinner 🍷","Evening 🌙"]
-    spots = sorted(spots_res.data or [],
-        key=lambda s: (s["day_num"], slot_order.index(s["slot"]) if s["slot"] in slot_order else 99))
-
-    return {
-        "id":         t["id"],
-        "title":      t["title"],
-        "city":       t["city"],
-        "days":       t["days"],
-        "cost":       t["cost"],
-        "status":     t.get("status", "Upcoming"),
-        "start_date": t.get("start_date"),
-        "end_date":   t.get("end_date"),
-        "weather":    {"condition": t["weather_condition"], "temp": t["weather_temp"]},
-        "forecast":   t.get("forecast") or {},
-        "spots":      spots,
-    }
+
+    headers = {"ETag": snap.etag, "Cache-Control": f"public, max-age={SHARE_MAX_AGE}"}
+    inm = request.headers.get("if-none-match")
+    if inm and etag_matches(inm, snap.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snap.body, media_type="application/json", headers=headers)
@@ -0,0 +1,48 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "locations.csv")
+
+
+class Api:
+    """TestClient over the app wired to the in-memory Supabase stand-in."""
+
+    def __init__(self, client, fake):
+        self.client = client
+        self.fake = fake
+
+    @staticmethod
+    def user() -> tuple[str, dict]:
+        """A fresh user id and its auth headers."""
+        from benchmarks import fakes
+        user_id = f"user-{uuid.uuid4().hex[:8]}"
+        return user_id, {"Authorization": f"Bearer {fakes.token(user_id)}"}
+
+    def generate(self, headers: dict, **body) -> dict:
+        import ratelimit
+        ratelimit.backend.clear()
+        res = self.client.post("/trips/generate", headers=headers,
+                               json={"title": "Trip", "city": "Paris", "days": 3, **body})
+        assert res.status_code == 200, res.text
+        return res.json()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    import pandas as pd
+    from fastapi.testclient import TestClient
+
+    from benchmarks import fakes
+    import dependencies
+    import main
+
+    monkeypatch.setenv("SUPABASE_JWT_SECRET", fakes.JWT_SECRET)
+    fake = fakes.install(pd.read_csv(CSV_PATH).to_dict("records"))
+    dependencies._token_cache.clear()
+    with TestClient(main.app) as client:
+        yield Api(client, fake)
@@ -0,0 +1,99 @@
+"""Which path get_current_user_id takes to verify a token: HS256 with the
+project secret, RS256/ES256 against the JWKS, or the Supabase Auth fallback."""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+
+import dependencies
+
+SECRET = "test-secret-test-secret-test-secret"
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _token(key=SECRET, alg="HS256", sub="user-1", ttl=3600, **headers):
+    claims = {"sub": sub, "aud": "authenticated", "exp": int(time.time()) + ttl}
+    return jwt.encode(claims, key, algorithm=alg, headers=headers or None)
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """Record Supabase Auth lookups; they answer with user `remote-user`."""
+    calls = []
+
+    def get_user_from_token(token):
+        calls.append(token)
+        return SimpleNamespace(user=SimpleNamespace(id="remote-user"))
+
+    monkeypatch.setattr(dependencies.db, "get_user_from_token", get_user_from_token)
+    monkeypatch.setattr(dependencies, "_jwks_client", None)
+    monkeypatch.setenv("SUPABASE_JWT_SECRET", SECRET)
+    monkeypatch.setenv("SUPABASE_URL", "https://project.supabase.co")
+    dependencies._token_cache.clear()
+    return calls
+
+
+def _user(token):
+    return asyncio.run(dependencies.get_current_user_id(f"Bearer {token}"))
+
+
+def test_hs256_verified_locally(remote):
+    assert _user(_token()) == "user-1"
+    assert remote == []
+
+
+def test_hs256_without_secret_falls_back(remote, monkeypatch):
+    monkeypatch.delenv("SUPABASE_JWT_SECRET")
+    assert _user(_token()) == "remote-user"
+    assert len(remote) == 1
+
+
+def test_bad_signature_rejected_without_fallback(remote):
+    with pytest.raises(HTTPException) as e:
+        _user(_token(key="another-secret-another-secret-xx"))
+    assert e.value.status_code == 401
+    assert remote == []
+
+
+def test_expired_token_rejected(remote):
+    with pytest.raises(HTTPException) as e:
+        _user(_token(ttl=-60))
+    assert e.value.status_code == 401
+
+
+def test_rs256_verified_against_jwks(remote, monkeypatch):
+    fetched = []
+
+    class Jwks:
+        def get_signing_key_from_jwt(self, token):
+            # the JWKS fetch blocks, so it must run off the event loop thread
+            assert threading.current_thread() is not threading.main_thread()
+            fetched.append(token)
+            return SimpleNamespace(key=RSA_KEY.public_key())
+
+    monkeypatch.setattr(dependencies, "_jwks_client", Jwks())
+    token = _token(RSA_KEY, "RS256", kid="k1")
+    assert _user(token) == "user-1"
+    assert _user(token) == "user-1"  # second call served from the token cache
+    assert fetched == [token]
+    assert remote == []
+
+
+def test_unknown_kid_falls_back(remote, monkeypatch):
+    class Jwks:
+        def get_signing_key_from_jwt(self, token):
+            raise jwt.PyJWKClientError("Unable to find a signing key")
+
+    monkeypatch.setattr(dependencies, "_jwks_client", Jwks())
+    assert _user(_token(RSA_KEY, "RS256", kid="rotated")) == "remote-user"
+    assert len(remote) == 1
+
+
+def test_unsupported_alg_falls_back(remote):
+    assert _user(_token(alg="HS512")) == "remote-user"
+    assert len(remote) == 1
@@ -0,0 +1,113 @@
+"""engine: the candidate filter, seeded plans and the plan cache."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import db
+import engine
+from cache import TTLCache
+
+from conftest import CSV_PATH
+
+
+@pytest.fixture
+def unknown_costs(monkeypatch) -> set[str]:
+    """Install a catalogue where every other Paris sight has no cost; returns
+    those names. The previous catalogue is put back afterwards."""
+    for name in ("_locations_cache", "_city_index", "_category_vocab"):
+        monkeypatch.setattr(db, name, getattr(db, name))
+    df = pd.read_csv(CSV_PATH)
+    sights = df.index[(df["city"] == "Paris") & ~df["category"].isin(["Hotel", "Food"])]
+    unknown = sights[::2]
+    df.loc[unknown, "cost"] = np.nan
+    db.set_locations(df)
+    return set(df.loc[unknown, "name"])
+
+
+def test_within_cap():
+    assert engine._within_cap(10, 10)
+    assert not engine._within_cap(11, 10)
+    assert not engine._within_cap(None, 10)
+    assert not engine._within_cap(float("nan"), 10)
+
+
+def _candidates(monkeypatch, **params) -> set[str] | None:
+    """Names plan() offers organize_itinerary as its preferred pool."""
+    seen = {}
+
+    def capture(candidates, city_index, **kwargs):
+        seen["names"] = None if candidates is None else {city_index.locs[i].name for i in candidates}
+        return []
+
+    monkeypatch.setattr(engine.itin, "organize_itinerary", capture)
+    engine.plan(engine.PlanParams(city="Paris", days=3, rest_mode=False, **params))
+    return seen["names"]
+
+
+def test_unknown_costs_are_left_out_under_a_cap(monkeypatch, unknown_costs):
+    names = _candidates(monkeypatch, max_activity_cost=10_000)
+    assert names and not names & unknown_costs
+    priced = {l.name for l in db.get_city_index("Paris").locs if l.cost == l.cost}
+    assert priced <= names
+
+
+def test_no_cap_keeps_every_candidate(monkeypatch, unknown_costs):
+    assert _candidates(monkeypatch) is None
+    assert unknown_costs <= _candidates(monkeypatch, user_preferences=tuple(
+        {l.category for l in db.get_city_index("Paris").locs}))
+
+
+# ── Seeded plans and the plan cache ───────────────────────────────────────────
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    for name in ("_locations_cache", "_city_index", "_category_vocab"):
+        monkeypatch.setattr(db, name, getattr(db, name))
+    monkeypatch.setattr(engine, "_plan_cache", TTLCache(16))
+    db.set_locations(pd.read_csv(CSV_PATH))
+
+
+def _params(**overrides) -> engine.PlanParams:
+    base = dict(city="Paris", days=3, rest_mode=True, user_preferences=("Art", "History"),
+                rainy_days=frozenset({2}), seed=42)
+    return engine.PlanParams(**{**base, **overrides})
+
+
+def test_same_seed_same_plan(catalogue):
+    import random
+    first = engine.plan(_params())
+    random.seed(0)  # the global generator plays no part
+    assert engine.plan(_params()) == first
+    assert any(engine.plan(_params(seed=s)) != first for s in range(5))
+
+
+def test_plan_key_ignores_ordering():
+    key = engine.plan_key(_params(user_preferences=("Art", "History"), rainy_days=frozenset({1, 2}),
+                                  exclude_visited=True, previously_used=frozenset({"a", "b"})))
+    assert key == engine.plan_key(_params(user_preferences=("History", "Art"), rainy_days=frozenset({2, 1}),
+                                          exclude_visited=True, previously_used=frozenset({"b", "a"})))
+
+
+def test_plan_key_tracks_visits_only_when_they_matter():
+    assert engine.plan_key(_params(previously_used=frozenset({"a"}))) == engine.plan_key(_params())
+    assert engine.plan_key(_params(exclude_visited=True, previously_used=frozenset({"a"}))) != \
+        engine.plan_key(_params(exclude_visited=True, previously_used=frozenset({"b"})))
+
+
+@pytest.mark.parametrize("change", [
+    {"seed": 43}, {"days": 2}, {"rest_mode": False}, {"chosen_hotel": "Hotel Ritz Paris"},
+    {"user_preferences": ("Art",)}, {"pinned_spot": "Louvre Museum"}, {"rainy_days": frozenset()},
+    {"max_activity_cost": 50.0}, {"exclude_visited": True}, {"city": "London"},
+])
+def test_plan_key_changes_with_any_input(change):
+    assert engine.plan_key(_params(**change)) != engine.plan_key(_params())
+
+
+def test_seeded_plans_are_cached_as_copies(catalogue):
+    first = engine.generate(_params())
+    first[0]["day_num"] = 99  # callers stamp their own fields
+    again = engine.generate(_params())
+    assert again[0]["day_num"] != 99
+    assert engine.plan_key(_params()) in dict(engine._plan_cache.items())
+    assert engine.generate(_params(seed=None)) is not None
+    assert len(engine._plan_cache.items()) == 1  # unseeded plans are never cached
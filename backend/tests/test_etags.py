@@ -0,0 +1,47 @@
+"""ETags on pre-serialized bodies: one weak tag across the raw, gzip and br
+encodings of a locations view, and weak If-None-Match comparison everywhere."""
+import pytest
+
+from routers.locations import etag_matches
+
+
+@pytest.mark.parametrize("header, etag, expected", [
+    ('"abc"', '"abc"', True),
+    ('W/"abc"', '"abc"', True),
+    ('"abc"', 'W/"abc"', True),
+    ('W/"abc"', 'W/"abc"', True),
+    ('"x", W/"abc"', 'W/"abc"', True),
+    ("*", 'W/"abc"', True),
+    ('"abd"', 'W/"abc"', False),
+])
+def test_weak_comparison(header, etag, expected):
+    assert etag_matches(header, etag) is expected
+
+
+def test_locations_etag_is_weak_and_shared_across_encodings(api):
+    _, headers = api.user()
+    tags = set()
+    for encoding in ("identity", "gzip", "br"):
+        res = api.client.get("/locations?city=Paris",
+                             headers={**headers, "Accept-Encoding": encoding})
+        assert res.status_code == 200
+        tags.add(res.headers["ETag"])
+    (etag,) = tags
+    assert etag.startswith('W/"')
+
+    for inm in (etag, etag.removeprefix("W/")):
+        res = api.client.get("/locations?city=Paris",
+                             headers={**headers, "If-None-Match": inm, "Accept-Encoding": "gzip"})
+        assert res.status_code == 304
+        assert res.headers["ETag"] == etag
+
+
+def test_share_snapshot_revalidates_with_a_weak_tag(api):
+    _, headers = api.user()
+    trip = api.generate(headers)
+    res = api.client.get(f"/share/{trip['id']}")
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+    for inm in (etag, f"W/{etag}"):
+        assert api.client.get(f"/share/{trip['id']}", headers={"If-None-Match": inm}).status_code == 304
+    assert api.client.get(f"/share/{trip['id']}", headers={"If-None-Match": '"stale"'}).status_code == 200
@@ -0,0 +1,89 @@
+"""_weighted_pick against the original list-of-dicts picker: same weights over
+the whole pool, so the same seed gives the same draws."""
+import math
+import os
+import random
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import itinerary as itin
+from catalogue import build_index
+
+CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "locations.csv")
+
+
+def legacy_weighted_pick(pool: list[dict], current_loc: dict, rng: random.Random) -> dict:
+    """The baseline picker: 1/d weights over every candidate, random.choices."""
+    def dist(a, b):
+        dlat = a["lat"] - b["lat"]
+        dlon = (a["lon"] - b["lon"]) * math.cos(math.radians(a["lat"]))
+        return math.sqrt(dlat ** 2 + dlon ** 2)
+
+    weights = [1.0 / max(dist(current_loc, s), 0.001) for s in pool]
+    return rng.choices(pool, weights=weights, k=1)[0]
+
+
+@pytest.fixture(scope="module")
+def catalogue() -> pd.DataFrame:
+    return pd.read_csv(CSV_PATH)
+
+
+def _cases(city_index, n_masks=5):
+    """(mask, current location) pairs: the whole city and random sub-pools,
+    seen from a few spots in it."""
+    n = len(city_index.locs)
+    rng = np.random.default_rng(0)
+    masks = [np.ones(n, dtype=bool)] + [rng.random(n) < 0.5 for _ in range(n_masks)]
+    for mask in masks:
+        if not mask.any():
+            continue
+        for start in (0, n // 2, n - 1):
+            yield mask, city_index.locs[start]
+
+
+@pytest.mark.parametrize("city", ["Paris", "London"])
+def test_pick_matches_baseline_draw_for_draw(catalogue, city):
+    idx = build_index(catalogue)[city]
+    for mask, here in _cases(idx):
+        pool = [idx.records[i] for i in np.flatnonzero(mask)]
+        here_rec = idx.records[here.id]
+        new_rng, old_rng = random.Random(7), random.Random(7)
+        for _ in range(200):
+            picked = itin._weighted_pick(mask, here, idx, new_rng)
+            assert idx.records[picked.id] is legacy_weighted_pick(pool, here_rec, old_rng)
+
+
+def test_pick_matches_baseline_on_a_large_city(catalogue):
+    rows = catalogue[catalogue["city"] == "Paris"].sample(n=5000, replace=True, random_state=0)
+    rows = rows.reset_index(drop=True)
+    rng = np.random.default_rng(0)
+    rows["name"] = rows["name"] + " #" + rows.index.astype(str)
+    rows["lat"] += rng.normal(0, 0.01, len(rows))
+    rows["lon"] += rng.normal(0, 0.01, len(rows))
+    idx = build_index(rows)["Paris"]
+    mask = np.asarray(idx.is_sight)
+    pool = [idx.records[i] for i in np.flatnonzero(mask)]
+    new_rng, old_rng = random.Random(3), random.Random(3)
+    for start in (0, 2500):
+        here = idx.locs[start]
+        for _ in range(100):
+            picked = itin._weighted_pick(mask, here, idx, new_rng)
+            assert idx.records[picked.id] is legacy_weighted_pick(pool, idx.records[start], old_rng)
+
+
+@pytest.mark.parametrize("city", ["Paris", "London"])
+def test_pick_frequencies_match_baseline(catalogue, city):
+    """Independent seeds: the pick distributions agree to within sampling noise."""
+    idx = build_index(catalogue)[city]
+    mask = np.asarray(idx.is_sight)
+    pool = [idx.records[i] for i in np.flatnonzero(mask)]
+    here = idx.locs[int(np.flatnonzero(mask)[0])]
+    draws = 20_000
+    new_rng, old_rng = random.Random(1), random.Random(2)
+    new = Counter(itin._weighted_pick(mask, here, idx, new_rng).name for _ in range(draws))
+    old = Counter(legacy_weighted_pick(pool, idx.records[here.id], old_rng)["name"] for _ in range(draws))
+    tv = sum(abs(new[k] - old[k]) for k in new.keys() | old.keys()) / (2 * draws)
+    assert tv < 0.05
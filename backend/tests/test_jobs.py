@@ -0,0 +1,95 @@
+"""Queued generation: job state is read back from the generation_jobs table, so
+any process can answer a poll and pick up jobs left behind by a dead one."""
+import time
+
+import jobs
+import ratelimit
+
+
+def _submit(api, headers, **body) -> str:
+    ratelimit.backend.clear()
+    res = api.client.post("/trips/generate?async=1", headers=headers,
+                          json={"title": "Trip", "city": "Paris", "days": 3, **body})
+    assert res.status_code == 202, res.text
+    assert res.headers["Location"] == f"/trips/jobs/{res.json()['job_id']}"
+    return res.json()["job_id"]
+
+
+def _wait(api, headers, job_id) -> dict:
+    for _ in range(200):
+        job = api.client.get(f"/trips/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish: {job}")
+
+
+def _row(api, job_id) -> dict:
+    return next(r for r in api.fake.tables["generation_jobs"] if r["id"] == job_id)
+
+
+def test_job_runs_and_is_only_visible_to_its_owner(api):
+    _, headers = api.user()
+    _, other = api.user()
+    job_id = _submit(api, headers)
+    job = _wait(api, headers, job_id)
+    assert job["status"] == "done"
+    assert job["result"]["spots"]
+    assert api.client.get(f"/trips/jobs/{job_id}", headers=other).status_code == 404
+
+
+def test_poll_on_another_process_reads_the_table(api):
+    _, headers = api.user()
+    job_id = _submit(api, headers)
+    done = _wait(api, headers, job_id)
+    jobs.queue._jobs.clear()  # as seen from a process that never ran it
+    job = api.client.get(f"/trips/jobs/{job_id}", headers=headers).json()
+    assert job["status"] == "done"
+    assert job["result"]["id"] == done["result"]["id"]
+
+
+def test_failures_are_recorded(api):
+    _, headers = api.user()
+    job_id = _submit(api, headers, max_budget=1)
+    jobs.queue._jobs.clear()
+    job = _wait(api, headers, job_id)
+    assert job["status"] == "failed"
+    assert job["error"]["status_code"] == 400
+
+
+def test_jobs_of_a_dead_process_are_recovered(api):
+    user_id, headers = api.user()
+    stale = time.time() - jobs.JOB_LEASE - 1
+    request = {"title": "Trip", "city": "Paris", "days": 2}
+    api.fake.tables.setdefault("generation_jobs", []).extend([
+        {"id": "queued-job", "user_id": user_id, "kind": "generate", "request": request,
+         "worker": "gone:1", "status": "queued", "created_at": stale, "heartbeat_at": stale},
+        {"id": "running-job", "user_id": user_id, "kind": "generate", "request": request,
+         "worker": "gone:1", "status": "running", "created_at": stale, "heartbeat_at": stale},
+    ])
+    jobs.queue.recover()
+
+    assert _wait(api, headers, "queued-job")["status"] == "done"
+    assert _row(api, "queued-job")["worker"] == jobs.WORKER_ID
+    job = _wait(api, headers, "running-job")
+    assert job["status"] == "failed" and job["error"] == jobs.INTERRUPTED
+
+
+def test_live_jobs_are_not_taken_over(api):
+    user_id, _ = api.user()
+    api.fake.tables.setdefault("generation_jobs", []).append(
+        {"id": "live-job", "user_id": user_id, "kind": "generate", "request": {},
+         "worker": "alive:1", "status": "queued", "created_at": time.time(),
+         "heartbeat_at": time.time()})
+    jobs.queue.recover()
+    assert _row(api, "live-job")["worker"] == "alive:1"
+
+
+def test_metrics_are_admin_only(api, monkeypatch):
+    admin_id, admin = api.user()
+    _, headers = api.user()
+    monkeypatch.setenv("ADMIN_USER_IDS", admin_id)
+    assert api.client.get("/trips/jobs/metrics", headers=headers).status_code == 403
+    res = api.client.get("/trips/jobs/metrics", headers=admin)
+    assert res.status_code == 200
+    assert res.json()["worker"] == jobs.WORKER_ID
@@ -0,0 +1,78 @@
+"""Memories belong to the trip's owner alone, and their images are only ever
+signed, accepted or removed under the owner's own `<user_id>/` folder of the
+memories bucket."""
+import pytest
+
+from benchmarks import fakes
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    paths = []
+    monkeypatch.setattr(fakes._Bucket, "remove", lambda self, p: paths.extend(p) or [])
+    return paths
+
+
+def test_foreign_image_path_rejected_on_save_and_update(api):
+    u1, _ = api.user()
+    u2, h2 = api.user()
+    trip = api.generate(h2)
+    res = api.client.post("/memories", headers=h2, json={
+        "trip_id": trip["id"], "day_num": 1, "note": "mine?", "image_path": f"{u1}/1-0.jpg"})
+    assert res.status_code == 400
+
+    for path in (f"{u1}/1-0.jpg", f"{u2}/../{u1}/1-0.jpg"):
+        mem = api.client.post("/memories", headers=h2, json={
+            "trip_id": trip["id"], "day_num": 1, "note": "ok"}).json()
+        res = api.client.patch(f"/memories/{mem['id']}", headers=h2, json={"image_path": path})
+        assert res.status_code == 400
+
+
+def test_own_image_path_signed(api):
+    u1, h1 = api.user()
+    trip = api.generate(h1)
+    path = f"{u1}/{trip['id']}/day1-0.jpg"
+    res = api.client.post("/memories", headers=h1, json={"trip_id": trip["id"], "day_num": 1, "image_path": path})
+    assert res.status_code == 200
+    days = api.client.get(f"/memories/{trip['id']}/days", headers=h1).json()
+    assert days[0]["memories"][0]["image_url"].startswith("https://storage.local/memories/" + path)
+
+
+def test_foreign_image_path_never_signed_or_removed(api, removed):
+    """A row that already points into another user's folder (written before
+    the check existed, or straight into the table) is served unsigned."""
+    u1, _ = api.user()
+    u2, h2 = api.user()
+    trip = api.generate(h2)
+    api.fake.table("memories").insert({
+        "trip_id": trip["id"], "day_num": 1, "note": "x",
+        "image_url": "", "image_path": f"{u1}/1-0.jpg"}).execute()
+
+    days = api.client.get(f"/memories/{trip['id']}/days", headers=h2).json()
+    mem = days[0]["memories"][0]
+    assert mem["image_url"] == ""
+
+    assert api.client.delete(f"/memories/{mem['id']}", headers=h2).status_code == 200
+    assert removed == []
+
+
+def test_other_users_cannot_read_or_change_memories(api):
+    _, owner = api.user()
+    _, intruder = api.user()
+    trip = api.generate(owner)
+    tid = trip["id"]
+    mem = api.client.post("/memories", headers=owner, json={"trip_id": tid, "day_num": 1, "note": "hi"}).json()
+    # the owner's reads warm the trip → owner cache; it must not let anyone else in
+    assert api.client.get(f"/memories/{tid}", headers=owner).status_code == 200
+
+    for path in (f"/memories/{tid}", f"/memories/{tid}/1", f"/memories/{tid}/days"):
+        assert api.client.get(path, headers=intruder).status_code == 403
+    assert api.client.post("/memories", headers=intruder,
+                           json={"trip_id": tid, "day_num": 1, "note": "x"}).status_code == 403
+    assert api.client.patch(f"/memories/{mem['id']}", headers=intruder,
+                            json={"note": "x"}).status_code == 403
+    assert api.client.delete(f"/memories/{mem['id']}", headers=intruder).status_code == 403
+    assert api.client.delete("/memories/no-such-memory", headers=intruder).status_code == 404
+
+    (kept,) = api.client.get(f"/memories/{tid}", headers=owner).json()
+    assert kept["id"] == mem["id"] and kept["note"] == "hi"
@@ -0,0 +1,33 @@
+"""The shared Postgres bucket backend: numbers from take_rate_token are the
+wait, anything else is an error, never an allowance."""
+import pytest
+
+import db
+import ratelimit
+
+POLICY = ratelimit.POLICIES["swap"]
+
+
+@pytest.fixture
+def backend(api, monkeypatch):
+    monkeypatch.setattr(db, "_rpc_missing", set())
+    return ratelimit.PostgresBackend()
+
+
+@pytest.mark.parametrize("answer, retry", [(0, 0.0), (0.0, 0.0), (2.5, 2.5)])
+def test_function_result_is_the_wait(api, backend, answer, retry):
+    api.fake.rpcs["take_rate_token"] = lambda _db, **params: answer
+    assert backend.take("swap:u", POLICY) == retry
+
+
+@pytest.mark.parametrize("answer", [None, [], {"wait": 0}, "0", True])
+def test_unexpected_result_raises(api, backend, answer):
+    api.fake.rpcs["take_rate_token"] = lambda _db, **params: answer
+    with pytest.raises(RuntimeError):
+        backend.take("swap:u", POLICY)
+
+
+def test_missing_function_falls_back_to_memory(api, backend):
+    api.fake.rpcs.pop("take_rate_token", None)
+    waits = [backend.take("generate:u", ratelimit.POLICIES["generate"]) for _ in range(2)]
+    assert waits[0] == 0 and waits[1] > 0
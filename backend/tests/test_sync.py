@@ -0,0 +1,74 @@
+"""GET /sync: watermark clock, `since` parsing, tombstones and resets."""
+from datetime import datetime, timedelta, timezone
+
+import db
+
+
+def _sync(api, headers, since=None):
+    res = api.client.get("/sync", headers=headers, params={"since": since} if since else None)
+    assert res.status_code == 200, res.text
+    return res.json()
+
+
+def test_watermark_comes_from_the_database_clock(api, monkeypatch):
+    _, h = api.user()
+    real = api.fake.rpcs["sync_changes"]
+    monkeypatch.setitem(api.fake.rpcs, "sync_changes",
+                        lambda fake, **kw: {**real(fake, **kw), "now": "2030-01-01T00:00:00+00:00"})
+    wm = _sync(api, h)["watermark"]
+    expected = datetime(2030, 1, 1, tzinfo=timezone.utc) - timedelta(seconds=db.SYNC_OVERLAP)
+    assert wm == expected.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def test_falls_back_to_separate_queries_without_the_function(api, monkeypatch):
+    _, h = api.user()
+    trip = api.generate(h)
+    monkeypatch.delitem(api.fake.rpcs, "sync_changes")
+    monkeypatch.setattr(db, "_rpc_missing", set())
+    full = _sync(api, h)
+    assert [t["id"] for t in full["trips"]] == [trip["id"]]
+    assert len(full["spots"]) == len(trip["spots"])
+
+
+def test_since_accepts_z_and_offsets(api):
+    _, h = api.user()
+    trip = api.generate(h)
+    wm = _sync(api, h)["watermark"]
+    assert wm.endswith("Z")
+    api.client.post("/memories", headers=h, json={"trip_id": trip["id"], "day_num": 1, "note": "new"})
+    for since in (wm, wm[:-1] + "+00:00", wm[:-1]):
+        changes = _sync(api, h, since)
+        assert changes["reset"] is False
+        assert [m["note"] for m in changes["memories"]] == ["new"]
+
+
+def test_bad_since_rejected(api):
+    _, h = api.user()
+    assert api.client.get("/sync", headers=h, params={"since": "yesterday"}).status_code == 400
+
+
+def test_deletes_come_back_as_tombstones(api):
+    _, h = api.user()
+    trip = api.generate(h)
+    wm = _sync(api, h)["watermark"]
+    assert api.client.delete(f"/trips/{trip['id']}", headers=h).status_code == 200
+    changes = _sync(api, h, wm)
+    assert changes["deleted"]["trips"] == [trip["id"]]
+    assert changes["trips"] == []
+
+
+def test_since_older_than_tombstones_resets(api):
+    _, h = api.user()
+    trip = api.generate(h)
+    old = (datetime.now(timezone.utc) - timedelta(days=db.TOMBSTONE_DAYS + 1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    changes = _sync(api, h, old)
+    assert changes["reset"] is True
+    assert [t["id"] for t in changes["trips"]] == [trip["id"]]
+
+
+def test_other_users_changes_stay_out(api):
+    _, h1 = api.user()
+    _, h2 = api.user()
+    api.generate(h1)
+    changes = _sync(api, h2)
+    assert changes["trips"] == [] and changes["spots"] == []
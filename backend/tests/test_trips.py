@@ -0,0 +1,148 @@
+"""Trip routes end to end against the in-memory Supabase stand-in."""
+import asyncio
+
+import pytest
+
+import db
+
+
+def test_catalogue_reads_stay_off_the_event_loop(api, monkeypatch):
+    """A cold locations cache means a Supabase fetch; async routes must make it
+    on the DB pool, not on the loop."""
+    real, on_loop = db.get_locations, []
+
+    def guarded():
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            pass
+        return real()
+
+    monkeypatch.setattr(db, "get_locations", guarded)
+    _, headers = api.user()
+    trip = api.generate(headers)
+    api.generate(headers, seed=1)
+    res = api.client.post(f"/trips/{trip['id']}/regenerate-day", headers=headers, json={"day_num": 2})
+    assert res.status_code == 200, res.text
+    assert not on_loop
+
+
+def _itinerary(trip: dict) -> list[tuple]:
+    return [(s["day_num"], s["slot"], s["name"]) for s in trip["spots"]]
+
+
+def test_same_seed_same_trip(api):
+    _, headers = api.user()
+    _, other = api.user()
+    first = api.generate(headers, seed=7, user_preferences=["Art", "History"])
+    assert _itinerary(api.generate(other, seed=7, user_preferences=["History", "Art"])) == _itinerary(first)
+    assert _itinerary(api.generate(headers, seed=7, user_preferences=["Art", "History"])) == _itinerary(first)
+
+
+def _activities(spots: list[dict]) -> set[str]:
+    return {s["name"] for s in spots if s["category"] != "Hotel"}
+
+
+def test_exclude_visited_avoids_earlier_trips(api):
+    _, headers = api.user()
+    first = api.generate(headers, days=2, seed=1)
+    for seed in (1, 2, 3):
+        fresh = api.generate(headers, days=1, seed=seed, exclude_visited=True)
+        assert not _activities(fresh["spots"]) & _activities(first["spots"])
+        api.client.delete(f"/trips/{fresh['id']}", headers=headers)
+
+
+def test_regenerated_day_avoids_the_rest_of_the_trip(api):
+    _, headers = api.user()
+    trip = api.generate(headers, days=3, seed=5)
+    res = api.client.post(f"/trips/{trip['id']}/regenerate-day", headers=headers,
+                          json={"day_num": 2, "seed": 9})
+    assert res.status_code == 200, res.text
+    new = _activities(res.json()["new_spots"])
+    assert new
+    assert not new & _activities(trip["spots"])
+
+
+# ── Trip list paging ──────────────────────────────────────────────────────────
+
+def _pages(api, headers, **params) -> list[list[dict]]:
+    pages, cursor = [], None
+    while True:
+        res = api.client.get("/trips", headers=headers,
+                             params={**params, **({"cursor": cursor} if cursor else {})})
+        assert res.status_code == 200, res.text
+        pages.append(res.json())
+        cursor = res.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_cursor_pages_cover_the_list_once(api):
+    _, headers = api.user()
+    for i in range(5):
+        api.generate(headers, title=f"Trip {i}")
+    full = api.client.get("/trips", headers=headers).json()
+    assert len(full) == 5
+
+    pages = _pages(api, headers, limit=2)
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert [t["id"] for p in pages for t in p] == [t["id"] for t in full]
+
+
+def test_cursor_breaks_created_at_ties_by_id(api):
+    _, headers = api.user()
+    for i in range(4):
+        api.generate(headers, title=f"Trip {i}")
+    stamp = api.fake.tables["trips"][0]["created_at"]
+    for row in api.fake.tables["trips"]:
+        row["created_at"] = stamp
+    ids = [t["id"] for p in _pages(api, headers, limit=3) for t in p]
+    assert sorted(ids) == sorted({t["id"] for t in api.fake.tables["trips"]})
+    assert len(ids) == len(set(ids)) == 4
+
+
+def test_summary_and_fields_projection(api):
+    _, headers = api.user()
+    api.generate(headers)
+    (summary,) = api.client.get("/trips", headers=headers, params={"summary": True}).json()
+    assert "spots" not in summary and {"id", "title", "city", "cost"} <= summary.keys()
+    (trip,) = api.client.get("/trips", headers=headers, params={"fields": "title,cost"}).json()
+    assert trip.keys() == {"id", "title", "cost"}
+
+
+@pytest.mark.parametrize("params", [
+    {"cursor": "not-a-cursor"},
+    {"cursor": db.encode_cursor("2026-01-01T00:00:00+00:00")},  # wrong arity
+    {"cursor": db.encode_cursor(1, 2)},                         # wrong types
+    {"fields": "title,password"},
+])
+def test_bad_paging_input_is_rejected(api, params):
+    _, headers = api.user()
+    res = api.client.get("/trips", headers=headers, params=params)
+    assert res.status_code == 400
+
+
+# ── Ownership ─────────────────────────────────────────────────────────────────
+
+def test_other_users_cannot_read_or_change_a_trip(api):
+    _, owner = api.user()
+    _, intruder = api.user()
+    trip = api.generate(owner)
+    tid, spot = trip["id"], trip["spots"][1]
+
+    assert api.client.get(f"/trips/{tid}", headers=intruder).status_code == 404
+    assert api.client.get(f"/trips/{tid}/spots", headers=intruder).status_code == 404
+    assert api.client.patch(f"/trips/{tid}/status", headers=intruder,
+                            json={"status": "Completed"}).status_code == 403
+    assert api.client.patch(f"/trips/{tid}/spots/{spot['id']}", headers=intruder, json={
+        "new_name": "X", "new_category": "Art", "new_type": "Indoor",
+        "new_lat": 0, "new_lon": 0, "new_cost": 1}).status_code == 403
+    assert api.client.post(f"/trips/{tid}/regenerate-day", headers=intruder,
+                           json={"day_num": 1}).status_code == 403
+    assert api.client.delete(f"/trips/{tid}", headers=intruder).status_code == 403
+    assert tid not in {t["id"] for t in api.client.get("/trips", headers=intruder).json()}
+
+    after = api.client.get(f"/trips/{tid}", headers=owner).json()
+    assert after["status"] == trip["status"]
+    assert _itinerary(after) == _itinerary(trip)